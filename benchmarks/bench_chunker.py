@@ -0,0 +1,43 @@
+# benchmarks/bench_chunker.py
+"""
+Chunker scaling benchmark: python benchmarks/bench_chunker.py
+Time per MB should stay flat as the input grows (linear scaling), including for
+inputs with no sentence breaks at all (e.g. pasted HTML dumps).
+"""
+import os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from utils import chunk_spans_sentence_aware, chunk_spans_content_defined
+
+WORDS = ("the user agrees that company may share personal data with partners terminate account "
+         "service liability arbitration fees renewal license content notice").split()
+
+def prose(n_chars, seed=0):
+    rng = random.Random(seed)
+    parts, size = [], 0
+    while size < n_chars:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))).capitalize() + "."
+        parts.append(sentence)
+        size += len(sentence) + 1
+    return " ".join(parts)[:n_chars]
+
+def no_breaks(n_chars, seed=0):
+    rng = random.Random(seed)
+    return " ".join(f"<td>{rng.choice(WORDS)}</td>" for _ in range(n_chars // 12))[:n_chars]
+
+def bench(func, text, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        spans = func(text, max_chars=3000, overlap_chars=200)
+        best = min(best, time.perf_counter() - t0)
+    return best, len(spans)
+
+if __name__ == "__main__":
+    print(f"{'chunker':<30} {'input':<10} {'size':>8} {'chunks':>7} {'seconds':>9} {'s/MB':>7}")
+    for func in (chunk_spans_sentence_aware, chunk_spans_content_defined):
+        for make in (prose, no_breaks):
+            for size in (100_000, 1_000_000, 4_000_000):
+                text = make(size)
+                seconds, chunks = bench(func, text)
+                print(f"{func.__name__:<30} {make.__name__:<10} {size:>8} {chunks:>7} {seconds:>9.3f} {seconds / (size / 1e6):>7.3f}")
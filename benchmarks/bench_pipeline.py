@@ -0,0 +1,116 @@
+# benchmarks/bench_pipeline.py
+"""
+End-to-end pipeline benchmark against the offline fake LLM backend (no network, no quota):
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --latency 0.8 --sigma 0.4 --rate-limit-rate 0.05
+    python benchmarks/bench_pipeline.py --corpus path/to/real_tos_docs
+
+Each document goes through extraction -> sanitize -> chunk -> analyze. Reports the median
+time per document over --repeat runs, throughput, LLM calls, p50/p95 latency over every LLM
+call of those runs (from the analysis trace, so client-side overhead and retries are included)
+and peak Python memory (measured in a separate tracemalloc pass, since tracing slows allocations down).
+"""
+import argparse, os, random, statistics, sys, tempfile, time, tracemalloc
+
+# Isolated cache/budget files and no client-side throttling, before the pipeline reads its settings
+_tmp = tempfile.mkdtemp(prefix="tos-bench-")
+os.environ["TOS_CACHE_PATH"] = os.path.join(_tmp, "cache.sqlite3")
+os.environ["TOS_BUDGET_PATH"] = os.path.join(_tmp, "budget.sqlite3")
+os.environ["TOS_DAILY_REQUEST_LIMIT"] = "100000000"
+os.environ["TOS_REQUESTS_PER_MINUTE"] = "100000000"
+os.environ["TOS_TRACE_PATH"] = "off"
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+import llm
+from pipeline import analyze_text, extract_document_text, SUPPORTED_EXTENSIONS
+
+WORDS = ("the user agrees that company may share personal data with partners terminate account "
+         "service liability arbitration fees renewal license content notice").split()
+HEADINGS = ("Privacy", "Payments", "Termination", "Dispute Resolution", "Content License", "Changes to These Terms")
+
+def synthetic_tos(n_chars, seed=0):
+    """ToS-like text: numbered sections, a running header and page number on every page, and one repeated addendum."""
+    rng = random.Random(seed)
+    addendum = "Arbitration addendum. " + " ".join(rng.choice(WORDS) for _ in range(300)) + "."
+    pages, size, section = [], 0, 1
+    while size < n_chars:
+        lines = ["Example Corp Terms of Service"]
+        for _ in range(rng.randint(3, 6)):
+            lines.append(f"{section}. {rng.choice(HEADINGS)}")
+            section += 1
+            for _ in range(rng.randint(2, 5)):
+                lines.append(" ".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 30))).capitalize() + "."
+                                      for _ in range(rng.randint(2, 6))))
+        if section % 40 < 6:
+            lines.append(addendum)
+        lines.append(f"Page {len(pages) + 1}")
+        page = "\n".join(lines)
+        pages.append(page)
+        size += len(page) + 1
+    return "\f".join(pages)[:n_chars]
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def run_document(path, max_workers):
+    t0 = time.perf_counter()
+    text = extract_document_text(path)
+    t1 = time.perf_counter()
+    result = analyze_text(text, max_workers=max_workers, use_cache=False)
+    t2 = time.perf_counter()
+    if "error" in result:
+        raise RuntimeError(f"{path}: {result['error']}")
+    call_ms = [s["duration_ms"] for s in result["trace"]["spans"] if s["name"] == "llm_call"]
+    return len(text), t1 - t0, t2 - t1, len(result["chunks"]), call_ms
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline offline.")
+    parser.add_argument("--sizes", default="5000,50000,500000,5000000", help="synthetic document sizes in characters")
+    parser.add_argument("--corpus", help="directory of real documents to include")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per document (default: 3)")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent LLM calls per document (default: 4)")
+    parser.add_argument("--latency", type=float, default=0.0, help="median fake LLM latency in seconds")
+    parser.add_argument("--sigma", type=float, default=0.0, help="lognormal spread of the fake latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls failing with a 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of calls failing with a 429")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    args = parser.parse_args(argv)
+
+    documents = []
+    for size in (int(s) for s in args.sizes.split(",") if s):
+        path = os.path.join(_tmp, f"synthetic_{size}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(synthetic_tos(size, seed=size))
+        documents.append(path)
+    if args.corpus:
+        documents += sorted(os.path.join(args.corpus, name) for name in os.listdir(args.corpus)
+                            if name.lower().endswith(SUPPORTED_EXTENSIONS))
+
+    print(f"{'document':<28} {'chars':>9} {'chunks':>6} {'calls':>6} {'extract s':>9} {'doc s':>8} {'MB/s':>7} "
+          f"{'call p50 ms':>11} {'call p95 ms':>11} {'peak MB':>8}")
+    for path in documents:
+        latencies, extract_times, calls, call_ms = [], [], [], []
+        for run in range(args.repeat):
+            backend = llm.FakeBackend(latency=args.latency, latency_sigma=args.sigma, error_rate=args.error_rate,
+                                      rate_limit_rate=args.rate_limit_rate, seed=run)
+            llm.set_backend(backend)
+            n_chars, extract_s, analyze_s, n_chunks, run_call_ms = run_document(path, args.workers)
+            latencies.append(extract_s + analyze_s)
+            extract_times.append(extract_s)
+            calls.append(backend.calls)
+            call_ms += run_call_ms
+        peak = float("nan")
+        if not args.no_memory:
+            llm.set_backend(llm.FakeBackend(seed=0))
+            tracemalloc.start()
+            run_document(path, args.workers)
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+        doc_s = statistics.median(latencies)
+        print(f"{os.path.basename(path)[:28]:<28} {n_chars:>9} {n_chunks:>6} {statistics.median(calls):>6.0f} "
+              f"{statistics.median(extract_times):>9.3f} {doc_s:>8.3f} {n_chars / 1e6 / doc_s:>7.2f} "
+              f"{percentile(call_ms, 50):>11.1f} {percentile(call_ms, 95):>11.1f} {peak:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# src/api_client.py
+import json
+import requests
+
+def analyze_remote(base_url, full_text, use_cache=True, on_plan=None, on_progress=None, timeout=30, upload=None):
+    """
+    Run an analysis on the HTTP API (src/server.py) instead of in-process.
+    Same callbacks and result shape as pipeline.analyze_text. upload=(filename, bytes) sends a
+    file for the service to extract and OCR instead of full_text; the text it extracted is then
+    returned as result['text'].
+    """
+    base_url = base_url.rstrip("/")
+    try:
+        if upload is not None:
+            filename, data = upload
+            job = requests.post(f"{base_url}/jobs", params={"filename": filename, "use_cache": int(bool(use_cache))},
+                                data=data, headers={"Content-Type": "application/octet-stream"}, timeout=timeout)
+        else:
+            job = requests.post(f"{base_url}/jobs", json={"text": full_text, "use_cache": use_cache}, timeout=timeout)
+        if job.status_code in (400, 413):
+            # Rejected upload (unsupported type, too large); its error dict explains why
+            return job.json()
+        job.raise_for_status()
+        job_id = job.json()["id"]
+        # No read timeout: a long analysis can go quiet between events (e.g. while rate limited)
+        with requests.get(f"{base_url}/jobs/{job_id}/events", stream=True, timeout=(timeout, None)) as events:
+            events.raise_for_status()
+            for line in events.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["event"] == "plan" and on_plan is not None:
+                    on_plan(event)
+                elif event["event"] == "progress" and on_progress is not None:
+                    on_progress(event["message"], event["fraction"])
+                elif event["event"] == "result":
+                    result = event["result"]
+                    if upload is not None and isinstance(result, dict) and "error" not in result:
+                        text = requests.get(f"{base_url}/jobs/{job_id}/text", timeout=timeout)
+                        text.raise_for_status()
+                        result["text"] = text.text
+                    return result
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"Analysis API error: {e}")
+        return {"error": "API_UNAVAILABLE", "message": f"Could not reach the analysis service at {base_url}."}
+    return {"error": "API_UNAVAILABLE", "message": "The analysis service closed the connection before finishing."}
@@ -1,8 +1,10 @@
 # src/app.py
 import streamlit as st
-import json, tempfile, os, time
-from utils import extract_text_from_pdf, extract_text_from_image_bytes, sanitize_text, chunk_text_sentence_aware, text_hash
-import google.generativeai as genai
+import json, tempfile, os
+from api_client import analyze_remote
+import tracing
+from pipeline import analyze_text, build_chat_index, chat_cache_missing, extract_document_text, forget_chat_cache, get_analysis_cache, get_chat_cache, get_request_budget, preview_analysis_plan, stream_gemini_prompt, CACHE_ENABLED
+import gemini_client
 from dotenv import load_dotenv
 import uuid
 
@@ -24,7 +26,12 @@ if not api_key or api_key == "your_api_key_here":
     st.error("Please set GEMINI_API_KEY in your .env file. Get your API key from: https://aistudio.google.com/app/apikey")
     st.stop()
 
-genai.configure(api_key=api_key)
+gemini_client.configure(api_key)
+
+# Number of document excerpts sent with each chat question
+CHAT_TOP_K = int(os.getenv("TOS_CHAT_TOP_K", "4"))
+# Analysis service (src/server.py) to send documents to; analyzed in this process when unset
+API_URL = os.getenv("TOS_API_URL", "")
 
 # -----------------------------
 # Custom CSS Styling
@@ -384,219 +391,39 @@ def format_qa_result(qa_data):
     </div>
     """
 
-# -----------------------------
-# Gemini API Prompt Runner
-# -----------------------------
-def run_gemini_prompt(prompt, model_name="gemini-1.5-flash", max_output_tokens=1024):
-    """
-    Use Google Generative AI to interact with Gemini model.
-    Returns JSON-parsed output if possible, else {'raw': ...}.
-    """
-    try:
-        model = genai.GenerativeModel(model_name)
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                max_output_tokens=max_output_tokens,
-                temperature=0.1,  # Low temperature for more consistent JSON output
-            )
-        )
-        text = response.text.strip()
-        
-        # Try to parse as JSON first
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            # Try to extract JSON from the response
-            import re
-            json_match = re.search(r'\{.*\}', text, re.DOTALL)
-            if json_match:
-                try:
-                    return json.loads(json_match.group())
-                except json.JSONDecodeError:
-                    pass
-            return {"raw": text}
-    except Exception as e:
-        error_msg = str(e)
-        # Check for quota exceeded error
-        if "429" in error_msg or "quota" in error_msg.lower() or "exceeded" in error_msg.lower():
-            return {"error": "API_QUOTA_EXCEEDED", "message": "Daily API quota exceeded. Please try again tomorrow or upgrade your plan."}
-        return {"error": error_msg}
-
-# -----------------------------
-# Analyze Text
-# -----------------------------
-def analyze_text(full_text):
-    full_text = sanitize_text(full_text)
-    t0 = time.time()
-    chunks = chunk_text_sentence_aware(full_text, max_chars=3000, overlap_chars=200)
-    
-    # Show progress container
-    progress_container = st.container()
-    with progress_container:
-        st.markdown('<div class="progress-container">', unsafe_allow_html=True)
-        st.markdown(f"### 📊 Analysis Progress")
-        
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.metric("📄 Text Length", f"{len(full_text):,} chars")
-        with col2:
-            st.metric("📦 Chunks", len(chunks))
-        with col3:
-            st.metric("⏱️ Status", "Processing...")
-        
-        st.markdown('</div>', unsafe_allow_html=True)
+def format_chat_response(answer):
+    """Format a (possibly partial) chat answer as a response card"""
+    return f"""
+            <div style="background: linear-gradient(135deg, #e8f4fd, #f0f8ff); 
+                        border: 2px solid #3b82f6; 
+                        border-radius: 16px; 
+                        padding: 2rem; 
+                        margin: 1rem 0;
+                        box-shadow: 0 8px 25px rgba(59, 130, 246, 0.15);">
+                <div style="display: flex; align-items: center; margin-bottom: 1rem;">
+                    <div style="background: #3b82f6; color: white; border-radius: 50%; width: 40px; height: 40px; 
+                                display: flex; align-items: center; justify-content: center; margin-right: 1rem; font-size: 1.2rem;">
+                        🤖
+                    </div>
+                    <h4 style="margin: 0; color: #1e40af; font-size: 1.3rem;">AI Assistant Response</h4>
+                </div>
+                <div style="background: white; padding: 1.5rem; border-radius: 12px; border-left: 4px solid #3b82f6;">
+                    <p style="margin: 0; font-size: 1.1rem; line-height: 1.6; color: #1f2937;">
+                        {answer}
+                    </p>
+                </div>
+                <div style="margin-top: 1rem; text-align: right;">
+                    <small style="color: #6b7280; font-style: italic;">
+                        💡 This response is based on your uploaded Terms of Service document
+                    </small>
+                </div>
+            </div>
+            """
 
-    # Summarize each chunk
-    chunk_summaries = []
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    for i, c in enumerate(chunks, start=1):
-        progress = i / len(chunks)
-        progress_bar.progress(progress)
-        status_text.text(f"🔍 Analyzing section {i} of {len(chunks)}...")
-        
-        prompt = f"""You are a helpful assistant that extracts key information from Terms of Service documents for regular users.
-
-Analyze this text chunk and extract important points that users should know about. Look for:
-- Data privacy and sharing policies
-- User rights and limitations  
-- Payment and billing terms
-- Account termination policies
-- Legal obligations and liabilities
-- Any concerning or important clauses
-
-Output ONLY valid JSON like:
-{{"bullets":[{{"text":"<clear explanation ≤200 chars>","excerpt":"<relevant quote from text (≤150 chars)>"}}]}}
-
-If you find important information, include it. If the text is unclear or contains no meaningful content, return {{"bullets":[]}}.
-
-Text chunk {i}:
-{c}"""
-        res = run_gemini_prompt(prompt, max_output_tokens=1024)
-        if isinstance(res, dict) and res.get("error") == "API_QUOTA_EXCEEDED":
-            st.error("❌ API quota exceeded. Analysis stopped.")
-            return {"error": "API_QUOTA_EXCEEDED", "chunks": chunk_summaries, "combined": {"summary": []}, "risks": [], "time": 0}
-        chunk_summaries.append(res)
-
-    # Consolidate summaries
-    combine_prompt = f"""You are consolidating summaries from a Terms of Service document analysis.
-
-Review all the chunk summaries below and create a comprehensive list of key points that users should know. 
-Combine similar points, remove duplicates, and prioritize the most important information.
-
-Focus on creating exactly 5 clear, actionable bullet points that cover:
-- Data privacy and sharing policies
-- User rights and account management
-- Payment and billing terms
-- Legal obligations and limitations
-- Any concerning clauses users should be aware of
-
-Output ONLY valid JSON: {{"summary": [{{"text":"<clear bullet point>","excerpt":"<supporting quote>"}}]}}
-
-Chunk summaries to consolidate:
-{json.dumps(chunk_summaries)}"""
-    combined = run_gemini_prompt(combine_prompt, max_output_tokens=1024)
-    if isinstance(combined, dict) and combined.get("error") == "API_QUOTA_EXCEEDED":
-        st.error("❌ API quota exceeded during consolidation.")
-        return {"error": "API_QUOTA_EXCEEDED", "chunks": chunk_summaries, "combined": {"summary": []}, "risks": [], "time": 0}
-
-    # Risk detection
-    risk_prompt = f"""You are a legal expert analyzing Terms of Service documents for potential risks to users. Your task is to identify at least 3 concerning clauses that users should be aware of.
-
-IMPORTANT: You MUST find at least 3 risks. Even if the document seems benign, look for:
-- Standard limitations that users might not expect
-- Common legal clauses that limit user rights
-- Industry-standard practices that could be concerning
-- Any clauses that give the company broad powers
-
-Look specifically for these types of risks:
-1. DATA & PRIVACY: Data collection, sharing, selling, or third-party access
-2. USER RIGHTS: Account termination, content removal, service limitations
-3. LEGAL PROTECTION: Arbitration clauses, liability limitations, class action waivers
-4. FINANCIAL: Automatic renewals, hidden fees, payment obligations
-5. INTELLECTUAL PROPERTY: User content ownership, licensing rights
-6. SERVICE TERMS: Downtime, changes without notice, geographic restrictions
-
-For each risk found, provide:
-- Type: Clear category name (e.g., "Data Sharing", "Arbitration Clause", "Account Termination")
-- Severity: Low/Medium/High based on potential impact
-- Excerpt: Direct quote from the document (max 200 chars)
-- Note: Brief explanation of why this matters to users
-
-Output ONLY valid JSON array with at least 3 risks:
-[{{"type":"Data Sharing","severity":"High","excerpt":"We may share your data with third parties...","note":"Your personal information could be sold to advertisers"}}, {{"type":"Arbitration Clause","severity":"Medium","excerpt":"All disputes must be resolved through binding arbitration...","note":"You cannot sue in court or join class action lawsuits"}}, {{"type":"Account Termination","severity":"Low","excerpt":"We reserve the right to terminate accounts at any time...","note":"Your account could be deleted without warning"}}]
-
-Document text:
-{full_text}"""
-    risks = run_gemini_prompt(risk_prompt, max_output_tokens=1024)
-    if isinstance(risks, dict) and risks.get("error") == "API_QUOTA_EXCEEDED":
-        st.error("❌ API quota exceeded during risk detection.")
-        return {"error": "API_QUOTA_EXCEEDED", "chunks": chunk_summaries, "combined": combined, "risks": [], "time": 0}
-    
-    # Debug: Log what we got from the API
-    if isinstance(risks, dict) and "raw" in risks:
-        # If we got raw text instead of JSON, try to extract JSON
-        import re
-        json_match = re.search(r'\[.*\]', risks["raw"], re.DOTALL)
-        if json_match:
-            try:
-                risks = json.loads(json_match.group())
-            except json.JSONDecodeError:
-                risks = []
-    
-    # Validate and ensure minimum risks
-    if not isinstance(risks, list):
-        risks = []
-    
-    # If we don't have at least 3 risks, try a simpler approach
-    if len(risks) < 3:
-        fallback_prompt = f"""Find at least 3 potential concerns in this Terms of Service document. Even common clauses can be risks.
-
-Look for ANY of these standard clauses that limit user rights:
-- Data collection/sharing policies
-- Account termination rights
-- Service modification rights
-- Liability limitations
-- Dispute resolution methods
-- Content ownership claims
-- Geographic restrictions
-- Automatic renewals
-
-Output as JSON array with exactly 3 risks:
-[{{"type":"[Risk Type]","severity":"[Low/Medium/High]","excerpt":"[quote from text]","note":"[why this matters]"}}]
-
-Document: {full_text[:2000]}..."""
-        
-        fallback_risks = run_gemini_prompt(fallback_prompt, max_output_tokens=512)
-        if isinstance(fallback_risks, list) and len(fallback_risks) >= 3:
-            risks = fallback_risks[:3]  # Take first 3
-        elif len(risks) == 0:
-            # Ultimate fallback - provide generic risks if nothing found
-            risks = [
-                {
-                    "type": "Data Collection",
-                    "severity": "Medium", 
-                    "excerpt": "Standard data collection practices",
-                    "note": "Most services collect user data - review privacy policy for details"
-                },
-                {
-                    "type": "Account Termination",
-                    "severity": "Low",
-                    "excerpt": "Service provider reserves termination rights",
-                    "note": "Your account could be terminated for policy violations"
-                },
-                {
-                    "type": "Service Changes",
-                    "severity": "Low",
-                    "excerpt": "Terms may be updated without notice",
-                    "note": "Service terms can change - check periodically for updates"
-                }
-            ]
-
-    t1 = time.time()
-    return {"chunks": chunk_summaries, "combined": combined, "risks": risks, "time": round(t1-t0,1)}
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_analysis_plan(text):
+    """preview_analysis_plan, computed once per pasted text rather than on every rerun (chat included)"""
+    return preview_analysis_plan(text)
 
 # -----------------------------
 # Main Flow
@@ -606,20 +433,42 @@ Document: {full_text[:2000]}..."""
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
     analyze_clicked = st.button("🚀 Analyze Terms of Service", type="primary", use_container_width=True)
+    use_cache = st.checkbox(
+        "♻️ Reuse saved results for identical documents",
+        value=CACHE_ENABLED,
+        help="Uncheck to force a fresh analysis even if this exact text was analyzed before"
+    )
+    if text_input and not uploaded:
+        n_chunks, n_calls, n_tokens = cached_analysis_plan(text_input)
+        st.caption(f"🧮 Plan: {n_chunks} section(s), about {n_calls} AI request(s) for ~{n_tokens:,} tokens "
+                   f"({get_request_budget().remaining_today()} requests left today)")
 
 if analyze_clicked:
     full_text = text_input
-    if uploaded:
+    remote_upload = None
+    # One trace covers extraction and analysis; analyze_text joins it and attaches it to the result
+    trace = tracing.Trace("analysis", source=uploaded.name if uploaded else "pasted text")
+    if uploaded and API_URL:
+        # The analysis service extracts and OCRs the file itself, so none of that runs on this host
+        remote_upload = (uploaded.name, uploaded.getvalue())
+    elif uploaded:
         with st.spinner("📖 Extracting text from uploaded file..."):
             b = uploaded.getbuffer()
             tmp = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded.name)[1])
             tmp.write(b)
             tmp.close()
-            ext = os.path.splitext(tmp.name)[1].lower()
-            if ext == ".pdf":
-                full_text = extract_text_from_pdf(tmp.name)
-            else:
-                full_text = extract_text_from_image_bytes(b)
+            page_progress = st.progress(0)
+            page_status = st.empty()
+
+            def report_page(done, total, stage):
+                page_progress.progress(done / total)
+                label = "🔎 Running OCR on" if stage == "ocr" else "📄 Reading"
+                page_status.text(f"{label} page {done} of {total}...")
+
+            with trace.activate():
+                full_text = extract_document_text(tmp.name, progress_callback=report_page)
+            page_progress.empty()
+            page_status.empty()
             os.unlink(tmp.name)
         
         # Debug: show extracted text preview
@@ -632,15 +481,53 @@ if analyze_clicked:
         line_count = len(full_text.split('\n'))
         st.metric("📊 Extracted Text Stats", f"{word_count} words, {line_count} lines")
 
-    if not full_text or len(full_text.strip()) < 10:
+    if not remote_upload and (not full_text or len(full_text.strip()) < 10):
         st.error("❌ No valid text found. Please paste text or upload a readable PDF/image.")
     else:
+        # Progress container is filled in once the run is planned
+        progress_container = st.container()
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+
+        def show_plan(plan):
+            with progress_container:
+                st.markdown('<div class="progress-container">', unsafe_allow_html=True)
+                st.markdown(f"### 📊 Analysis Progress")
+                
+                col1, col2, col3, col4, col5 = st.columns(5)
+                with col1:
+                    st.metric("📄 Text Length", f"{plan['text_chars']:,} chars", f"-{plan['tokens_saved']:,} boilerplate tokens", delta_color="off")
+                with col2:
+                    st.metric("📦 Chunks", plan["chunks"], f"~{plan['tokens']:,} tokens", delta_color="off")
+                with col3:
+                    st.metric("🧬 Duplicates Skipped", plan["skipped"], f"{plan['duplicates']} repeated section(s)", delta_color="off")
+                with col4:
+                    st.metric("🎫 Requests Planned", plan["planned_calls"], f"{plan['remaining_requests']} left today", delta_color="off")
+                with col5:
+                    st.metric("⏱️ Status", "Processing...")
+                
+                st.markdown('</div>', unsafe_allow_html=True)
+
+        def show_progress(message, fraction=None):
+            if fraction is not None:
+                progress_bar.progress(fraction)
+            status_text.text(message)
+
         # Run analysis directly
         with st.spinner("🧠 AI is analyzing your Terms of Service..."):
-            result = analyze_text(full_text)
+            if API_URL:
+                result = analyze_remote(API_URL, full_text, use_cache=use_cache, on_plan=show_plan, on_progress=show_progress,
+                                        upload=remote_upload)
+                if isinstance(result, dict) and "text" in result:
+                    full_text = result.pop("text")
+            else:
+                with trace.activate():
+                    result = analyze_text(full_text, use_cache=use_cache, on_plan=show_plan, on_progress=show_progress)
+                trace.finish()
         
-        # Clear progress indicators
-        st.empty()
+        if isinstance(result, dict) and result.get("error") in ("BUDGET_EXCEEDED", "API_UNAVAILABLE", "NO_TEXT", "TOO_LARGE", "BAD_REQUEST"):
+            st.error(f"❌ {result['message']}")
+            st.stop()
         
         # Check for API quota error
         if isinstance(result, dict) and result.get("error") == "API_QUOTA_EXCEEDED":
@@ -654,6 +541,8 @@ if analyze_clicked:
             
             The text has been extracted successfully - you can still read it manually.
             """)
+            if result.get("resumable"):
+                st.info("💾 Progress was saved. Analyzing the same document again will resume where it stopped.")
             st.stop()
         
         # Display results in beautiful format
@@ -682,21 +571,37 @@ if analyze_clicked:
             st.success("✅ No significant risks detected in this document!")
         st.markdown('</div>', unsafe_allow_html=True)
         
-        # Store the analyzed text in session state for chatbot
+        # Store the analyzed text in session state for chatbot, with a retrieval index built once per document
         st.session_state.analyzed_text = full_text
+        st.session_state.analysis_summary = result["combined"]
+        st.session_state.chat_index, st.session_state.chat_spans = build_chat_index(full_text)
         
         # Analysis metrics
         st.markdown("---")
-        col1, col2, col3, col4 = st.columns(4)
+        col1, col2, col3, col4, col5 = st.columns(5)
         with col1:
-            st.metric("⏱️ Analysis Time", f"{result['time']}s")
+            st.metric("⏱️ Analysis Time", f"{result['time']}s", "cached" if result.get("cached") else None, delta_color="off")
         with col2:
-            st.metric("📄 Text Length", f"{len(full_text):,} chars")
+            saved = result.get("tokens_saved", 0)
+            st.metric("📄 Text Length", f"{len(full_text):,} chars", f"-{saved:,} tokens of boilerplate" if saved else None, delta_color="off")
         with col3:
-            st.metric("📦 Sections Analyzed", len(result.get("chunks", [])))
+            duplicate_chunks = result.get("duplicate_chunks", 0)
+            st.metric("📦 Sections Analyzed", len(result.get("chunks", [])),
+                      f"{duplicate_chunks} repeated" if duplicate_chunks else None, delta_color="off")
         with col4:
             risk_count = len(result.get("risks", [])) if isinstance(result.get("risks"), list) else 0
             st.metric("⚠️ Risks Found", risk_count)
+        with col5:
+            cache_stats = get_analysis_cache().stats()
+            st.metric("♻️ Cache Hits / Misses", f"{cache_stats['hits']} / {cache_stats['misses']}")
+        
+        # Where the time went, per pipeline stage (the full span list is in the downloaded JSON)
+        stages = result.get("trace", {}).get("stages", {})
+        if stages:
+            with st.expander("⏱️ Timing by stage"):
+                for name, stage in sorted(stages.items(), key=lambda item: -item[1]["total_ms"]):
+                    st.markdown(f"**{name}** · {stage['count']}× · {stage['total_ms'] / 1000:.2f}s total, "
+                                f"slowest {stage['max_ms'] / 1000:.2f}s")
         
         # Download section
         st.markdown("---")
@@ -791,61 +696,58 @@ if 'analyzed_text' in st.session_state and st.session_state.analyzed_text:
             st.session_state.chat_history.append({"role": "user", "content": user_question})
             
             # Generate AI response
-            with st.spinner("🤔 Thinking..."):
+            # Long documents are cached on Gemini's side once, so each question only sends the question;
+            # otherwise only the most relevant excerpts are sent instead of the whole document
+            cache_name = get_chat_cache(st.session_state.analyzed_text, st.session_state.get("analysis_summary"))
+            if cache_name:
+                sources = []
+                chat_prompt = f"USER QUESTION: {user_question}"
+            else:
+                if 'chat_index' not in st.session_state or 'chat_spans' not in st.session_state:
+                    st.session_state.chat_index, st.session_state.chat_spans = build_chat_index(st.session_state.analyzed_text)
+                sources = st.session_state.chat_index.search(user_question, k=CHAT_TOP_K)
+                context = "\n\n".join(f"[Excerpt {i + 1}]\n{chunk}" for i, chunk, _ in sources)
                 chat_prompt = f"""You are a helpful assistant that answers questions about Terms of Service documents. 
                 
-                CONTEXT (the analyzed document):
-                {st.session_state.analyzed_text}
+                CONTEXT (the most relevant excerpts from the analyzed document):
+                {context}
                 
                 USER QUESTION: {user_question}
                 
-                Please provide a clear, helpful answer based on the document. If the information isn't in the document, say so. 
+                Please provide a clear, helpful answer based on these excerpts and cite them like [Excerpt N]. If the information isn't in the excerpts, say so. 
                 Keep your answer concise but informative."""
-                
-                response = run_gemini_prompt(chat_prompt, max_output_tokens=512)
-                
-                if isinstance(response, dict) and "raw" in response:
-                    ai_response = response["raw"]
-                elif isinstance(response, dict) and response.get("error") == "API_QUOTA_EXCEEDED":
-                    ai_response = "❌ Daily API quota exceeded. Please try again tomorrow or upgrade your plan."
-                elif isinstance(response, dict) and "error" in response:
-                    ai_response = f"Sorry, I encountered an error: {response['error']}"
+            
+            # Display the response as it streams in, in a beautiful format
+            st.markdown("#### 🤖 AI Response:")
+            response_card = st.empty()
+            response_card.markdown(format_chat_response("🤔 Thinking..."), unsafe_allow_html=True)
+            ai_response = ""
+            for piece in stream_gemini_prompt(chat_prompt, max_output_tokens=512, cached_content=cache_name):
+                if cache_name and chat_cache_missing(piece):
+                    # The cache was deleted or expired early; the next question starts a new one
+                    forget_chat_cache(cache_name)
+                if isinstance(piece, dict) and piece.get("error") == "API_QUOTA_EXCEEDED":
+                    ai_response += "❌ Daily API quota exceeded. Please try again tomorrow or upgrade your plan."
+                elif isinstance(piece, dict):
+                    ai_response += f"Sorry, I encountered an error: {piece['error']}"
                 else:
-                    ai_response = str(response)
+                    ai_response += piece
+                response_card.markdown(format_chat_response(ai_response + " ▌"), unsafe_allow_html=True)
+            if not ai_response:
+                ai_response = "Sorry, I couldn't generate an answer. Please try rephrasing your question."
+            response_card.markdown(format_chat_response(ai_response), unsafe_allow_html=True)
             
             # Add AI response to history
             st.session_state.chat_history.append({"role": "assistant", "content": ai_response})
             
-            # Display the response immediately in a beautiful format
-            st.markdown("#### 🤖 AI Response:")
-            
-            # Create a beautiful response card
-            st.markdown(f"""
-            <div style="background: linear-gradient(135deg, #e8f4fd, #f0f8ff); 
-                        border: 2px solid #3b82f6; 
-                        border-radius: 16px; 
-                        padding: 2rem; 
-                        margin: 1rem 0;
-                        box-shadow: 0 8px 25px rgba(59, 130, 246, 0.15);">
-                <div style="display: flex; align-items: center; margin-bottom: 1rem;">
-                    <div style="background: #3b82f6; color: white; border-radius: 50%; width: 40px; height: 40px; 
-                                display: flex; align-items: center; justify-content: center; margin-right: 1rem; font-size: 1.2rem;">
-                        🤖
-                    </div>
-                    <h4 style="margin: 0; color: #1e40af; font-size: 1.3rem;">AI Assistant Response</h4>
-                </div>
-                <div style="background: white; padding: 1.5rem; border-radius: 12px; border-left: 4px solid #3b82f6;">
-                    <p style="margin: 0; font-size: 1.1rem; line-height: 1.6; color: #1f2937;">
-                        {ai_response}
-                    </p>
-                </div>
-                <div style="margin-top: 1rem; text-align: right;">
-                    <small style="color: #6b7280; font-style: italic;">
-                        💡 This response is based on your uploaded Terms of Service document
-                    </small>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
+            if sources:
+                with st.expander(f"📚 Sources ({len(sources)} excerpts used)"):
+                    # Offsets are into the cleaned text the excerpts came from, not the uploaded file
+                    st.caption("Positions refer to the cleaned-up text, after running headers, footers and page numbers were removed.")
+                    for i, chunk, _ in sources:
+                        start, end = st.session_state.chat_spans[i]
+                        st.markdown(f"**Excerpt {i + 1}** · characters {start:,}–{end:,} of the cleaned text")
+                        st.caption(chunk[:500] + ("..." if len(chunk) > 500 else ""))
             
             st.success("✅ Response added to conversation history!")
     
@@ -0,0 +1,114 @@
+# src/batch.py
+"""
+Analyze a directory (or glob) of Terms of Service documents without the UI.
+
+    python src/batch.py vendor_terms/ -o results/
+    python src/batch.py "vendor_terms/**/*.pdf" -o results/ --jobs 4
+
+Writes one JSON result per document. Documents whose result already exists are skipped, and a
+document interrupted by the request budget resumes from its checkpoint on the next run, so the
+same command can be repeated until everything is done.
+"""
+import argparse, glob, json, os, sys, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+import gemini_client, tracing
+from pipeline import analyze_text, extract_document_text, get_request_budget, SUPPORTED_EXTENSIONS
+
+def find_documents(target):
+    """Supported files under a directory (recursively) or matching a glob pattern, sorted."""
+    if os.path.isdir(target):
+        paths = glob.glob(os.path.join(target, "**", "*"), recursive=True)
+    else:
+        paths = glob.glob(target, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(SUPPORTED_EXTENSIONS))
+
+def result_path(path, root, out_dir):
+    """Output file for path, mirroring its location under root so equal file names cannot collide."""
+    rel = os.path.relpath(os.path.abspath(path), root)
+    return os.path.join(out_dir, os.path.splitext(rel)[0] + ".json")
+
+def write_json(path, data):
+    # Write then rename, so an interrupted run never leaves a truncated result that would be skipped
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+def analyze_document(path, out_path, use_cache=None):
+    """
+    Extract and analyze one document; returns (status, message). Only clean results are written.
+    use_cache=None follows TOS_CACHE_DISABLED, like analyze_text.
+    """
+    t0 = time.time()
+    # Extraction and analysis share one trace, which ends up in the result file
+    with tracing.start_trace("analysis", source=os.path.abspath(path)):
+        try:
+            text = extract_document_text(path)
+        except Exception as e:
+            return "failed", f"extraction error: {e}"
+        if not text or len(text.strip()) < 10:
+            return "failed", "no readable text"
+        result = analyze_text(text, use_cache=use_cache)
+    if result.get("error") in ("API_QUOTA_EXCEEDED", "BUDGET_EXCEEDED"):
+        return "quota", result.get("message", result["error"])
+    failed = [r for r in result["chunks"] + [result["combined"]] if isinstance(r, dict) and "error" in r]
+    if failed:
+        return "failed", f"{len(failed)} request(s) failed: {failed[0]['error']}"
+    write_json(out_path, dict(result, source=os.path.abspath(path), analyzed_at=time.strftime("%Y-%m-%dT%H:%M:%S")))
+    return "done", f"{len(result['risks'])} risk(s) in {round(time.time() - t0, 1)}s"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a directory or glob of Terms of Service documents.")
+    parser.add_argument("target", help="directory (searched recursively) or glob pattern")
+    parser.add_argument("-o", "--output", default="tos_results", help="directory for the JSON results (default: tos_results)")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="documents analyzed at the same time (default: 2)")
+    parser.add_argument("--force", action="store_true", help="re-analyze documents that already have a result")
+    parser.add_argument("--no-cache", action="store_true", help="do not reuse cached analyses of identical text")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("Please set GEMINI_API_KEY in the environment or a .env file.", file=sys.stderr)
+        return 2
+    gemini_client.configure(api_key)
+
+    documents = find_documents(args.target)
+    if not documents:
+        print(f"No supported documents found for {args.target}", file=sys.stderr)
+        return 1
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in documents])
+    todo = [(p, result_path(p, root, args.output)) for p in documents]
+    if not args.force:
+        todo = [(p, out) for p, out in todo if not os.path.exists(out)]
+    print(f"{len(documents)} document(s), {len(documents) - len(todo)} already analyzed, "
+          f"{len(todo)} to go ({get_request_budget().remaining_today()} requests left today)")
+
+    # Documents run on a small thread pool; each analysis fans out its own chunk requests, and all of
+    # them draw from the one process-wide request budget
+    counts = {"done": 0, "failed": 0, "quota": 0}
+    executor = ThreadPoolExecutor(max_workers=max(1, args.jobs))
+    futures = {executor.submit(analyze_document, p, out, False if args.no_cache else None): p for p, out in todo}
+    try:
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            path = futures[future]
+            status, message = future.result()
+            counts[status] += 1
+            print(f"[{status}] {path}: {message}")
+            if status == "quota":
+                # Leave the remaining documents for the next run instead of failing each of them
+                for f in futures:
+                    f.cancel()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    skipped = len(todo) - sum(counts.values())
+    print(f"{counts['done']} analyzed, {counts['failed']} failed, {counts['quota'] + skipped} postponed until the request budget allows")
+    return 0 if counts["failed"] == 0 and counts["quota"] + skipped == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# src/cache.py
+import sqlite3, json, os, time, threading
+from contextlib import contextmanager
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "tos-decoder", "analysis.sqlite3")
+
+class AnalysisCache:
+    """
+    Persistent SQLite store for analysis results, keyed by text hash + pipeline version.
+    Entries older than max_age_seconds are dropped, and the least recently used
+    entries are evicted once the stored payloads exceed max_bytes.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=200 * 1024 * 1024, max_age_seconds=30 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL)""")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _bump(self, conn, name, n=1):
+        conn.execute("INSERT INTO stats (name, value) VALUES (?, ?) "
+                     "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, n))
+
+    def record(self, counter, hits, misses):
+        """Add hits/misses for lookups made with counter=None."""
+        with self._lock, self._connect() as conn:
+            self._bump(conn, counter + "hits", hits)
+            self._bump(conn, counter + "misses", misses)
+
+    def get(self, key, counter=""):
+        """
+        Return the cached value for key (or None) and record a hit/miss under the counter prefix.
+        Pass counter=None for lookups that should not be counted.
+        """
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] > self.max_age_seconds:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                if counter is not None:
+                    self._bump(conn, counter + "misses")
+                return None
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            if counter is not None:
+                self._bump(conn, counter + "hits")
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                         (key, data, len(data), now, now))
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM entries WHERE created < ?", (now - self.max_age_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until we are back under the size budget
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC").fetchall():
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self, counter=""):
+        """Return {'hits', 'misses', 'entries', 'bytes'} for display."""
+        with self._lock, self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": counters.get(counter + "hits", 0), "misses": counters.get(counter + "misses", 0), "entries": entries, "bytes": size}
+
+    def delete(self, key):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM entries")
@@ -0,0 +1,63 @@
+# src/dedupe.py
+import re, zlib
+import numpy as np
+
+# Mersenne prime for the universal hash family h(x) = (a*x + b) mod P
+_PRIME = (1 << 61) - 1
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+def _shingles(text, size):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+class MinHasher:
+    """
+    MinHash signatures over word shingles. Permutations are fixed by seed, so signatures
+    are comparable across chunks of a run; the fraction of equal slots estimates Jaccard similarity.
+    """
+
+    def __init__(self, num_perm=64, shingle_size=5, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+    def signature(self, text):
+        shingles = _shingles(text, self.shingle_size)
+        if not shingles:
+            return np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # 32-bit inputs and coefficients keep a*x + b below 2**64; the mod keeps it in 61 bits
+        permuted = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % np.uint64(_PRIME)
+        return permuted.min(axis=1)
+
+def find_near_duplicates(chunks, threshold=0.85, num_perm=64, bands=16):
+    """
+    Map index -> index of an earlier chunk whose estimated Jaccard similarity is at least threshold.
+    Candidates come from LSH banding, so the run is close to linear in the number of chunks;
+    originals are never themselves duplicates.
+    """
+    hasher = MinHasher(num_perm=num_perm)
+    rows = num_perm // bands
+    signatures = [hasher.signature(c) for c in chunks]
+    buckets = {}
+    duplicates = {}
+    for i, sig in enumerate(signatures):
+        candidates = set()
+        keys = [(band, sig[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+        for key in keys:
+            candidates.update(buckets.get(key, ()))
+        best = None
+        for j in sorted(candidates):
+            similarity = float(np.mean(signatures[j] == sig))
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (j, similarity)
+        if best is not None:
+            duplicates[i] = best[0]
+            continue
+        for key in keys:
+            buckets.setdefault(key, []).append(i)
+    return duplicates
@@ -0,0 +1,82 @@
+# src/gemini_client.py
+import datetime, threading
+import google.generativeai as genai
+
+# Module state survives Streamlit reruns (the module is imported once per process),
+# so every session shares one configured client channel and one model object per name.
+_lock = threading.Lock()
+_models = {}
+_limits = {}
+_configured_key = None
+
+# (input, output) token limits used when the models endpoint cannot be reached
+KNOWN_LIMITS = {
+    "gemini-1.5-flash": (1048576, 8192),
+    "gemini-1.5-pro": (2097152, 8192),
+}
+
+def configure(api_key):
+    """
+    Configure the SDK once per process. genai.configure() drops the cached service clients
+    (and their open connections), so calling it on every script rerun forced a reconnect.
+    """
+    global _configured_key
+    with _lock:
+        if api_key == _configured_key:
+            return
+        genai.configure(api_key=api_key)
+        _configured_key = api_key
+        _models.clear()
+
+def get_model(model_name):
+    """Shared GenerativeModel for model_name; its service client is reused across calls and sessions."""
+    with _lock:
+        model = _models.get(model_name)
+        if model is None:
+            model = _models[model_name] = genai.GenerativeModel(model_name)
+        return model
+
+def create_cache(model_name, contents, system_instruction, ttl_seconds):
+    """Register contents as a server-side context cache for model_name; returns the cache name."""
+    cache = genai.caching.CachedContent.create(
+        model=f"models/{model_name}",
+        display_name="tos-decoder",
+        system_instruction=system_instruction,
+        contents=contents,
+        ttl=datetime.timedelta(seconds=ttl_seconds),
+    )
+    with _lock:
+        _models[cache.name] = genai.GenerativeModel.from_cached_content(cache)
+    return cache.name
+
+def delete_cache(cache_name):
+    """Delete the server-side context cache cache_name, which is billed until deleted or expired."""
+    with _lock:
+        _models.pop(cache_name, None)
+    genai.caching.CachedContent.get(cache_name).delete()
+
+def get_cached_model(cache_name):
+    """GenerativeModel that answers with the context cache cache_name in front of each prompt."""
+    with _lock:
+        model = _models.get(cache_name)
+    if model is None:
+        model = genai.GenerativeModel.from_cached_content(cache_name)
+        with _lock:
+            _models[cache_name] = model
+    return model
+
+def get_model_limits(model_name):
+    """(input_token_limit, output_token_limit) for model_name, looked up once per process."""
+    with _lock:
+        if model_name in _limits:
+            return _limits[model_name]
+    try:
+        # Short and without SDK retries: this runs on the script thread before the first rerun renders
+        info = genai.get_model(f"models/{model_name}", request_options={"timeout": 5, "retry": None})
+        limits = (info.input_token_limit, info.output_token_limit)
+    except Exception as e:
+        print(f"Model info lookup error: {e}")
+        limits = KNOWN_LIMITS.get(model_name, (32768, 8192))
+    with _lock:
+        _limits[model_name] = limits
+    return limits
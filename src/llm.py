@@ -0,0 +1,207 @@
+# src/llm.py
+"""
+LLM backends used by the pipeline's prompt runners.
+
+A backend turns a prompt into text: generate(prompt, model_name, max_output_tokens, timeout)
+returns the response text, and with stream=True an iterator of text pieces. With a schema
+(see schemas.py) the response must be JSON matching it. create_cache() registers long context
+(a document) once, generate(..., cached_content=name) answers with it in front of the prompt,
+and delete_cache(name) frees it before its TTL ends. Backends that know the real token counts
+put them in the usage dict passed to generate (prompt_tokens, response_tokens, cached_tokens),
+filled in once the response, or the whole stream, has been read.
+Backends raise the SDK's exceptions on failure so retry.classify_error works unchanged.
+GeminiBackend calls the API; FakeBackend answers offline with canned JSON, for benchmarks
+and development without network or quota. Pick one with TOS_LLM_BACKEND=gemini|fake.
+"""
+import json, math, os, random, re, threading, time
+from google.api_core import exceptions as api_exceptions
+import google.generativeai as genai
+import gemini_client
+
+class GeminiBackend:
+    name = "gemini"
+
+    def generate(self, prompt, model_name, max_output_tokens=1024, timeout=None, stream=False, schema=None,
+                 cached_content=None, usage=None):
+        # A cached-content model is bound to the model the cache was created for
+        model = gemini_client.get_cached_model(cached_content) if cached_content else gemini_client.get_model(model_name)
+        # A response schema makes the model emit JSON of exactly that shape (constrained decoding)
+        json_mode = {"response_mime_type": "application/json", "response_schema": schema} if schema else {}
+        response = model.generate_content(
+            prompt,
+            generation_config=genai.types.GenerationConfig(
+                max_output_tokens=max_output_tokens,
+                temperature=0.1,  # Low temperature for more consistent JSON output
+                **json_mode
+            ),
+            stream=stream,
+            request_options={"timeout": timeout}
+        )
+        if stream:
+            return _stream_text(response, usage)
+        _record_usage(response, usage)
+        return response.text
+
+    def create_cache(self, model_name, contents, system_instruction, ttl_seconds):
+        return gemini_client.create_cache(model_name, contents, system_instruction, ttl_seconds)
+
+    def delete_cache(self, name):
+        gemini_client.delete_cache(name)
+
+    def model_limits(self, model_name):
+        return gemini_client.get_model_limits(model_name)
+
+def _record_usage(response, usage):
+    """Copy the token counts Gemini reports in response.usage_metadata into usage."""
+    metadata = getattr(response, "usage_metadata", None)
+    if usage is None or not metadata or not metadata.prompt_token_count:
+        return
+    usage["prompt_tokens"] = metadata.prompt_token_count
+    usage["response_tokens"] = metadata.candidates_token_count
+    if metadata.cached_content_token_count:
+        usage["cached_tokens"] = metadata.cached_content_token_count
+
+def _stream_text(response, usage=None):
+    for chunk in response:
+        # Every chunk carries the counts so far; the last one has the totals
+        _record_usage(chunk, usage)
+        # Chunks without text (e.g. safety or finish metadata) raise on .text
+        try:
+            piece = chunk.text
+        except ValueError:
+            continue
+        if piece:
+            yield piece
+
+# Which canned answer a prompt gets, by a phrase unique to each pipeline prompt
+PROMPT_KINDS = (
+    ("Text chunk", "chunk"),
+    ("merging partial summaries", "merge"),
+    ("consolidating summaries", "summary"),
+    ("Find at least 3 potential concerns", "risks"),
+)
+
+RISK_TYPES = ("Data Sharing", "Arbitration", "Account Termination", "Automatic Renewal", "Liability Limitation")
+SEVERITIES = ("High", "Medium", "Low")
+
+class FakeBackend:
+    """
+    Deterministic offline stand-in for Gemini.
+    Latency per call is lognormal around latency seconds (spread latency_sigma) plus
+    seconds_per_1k_tokens for the prompt size. error_rate and rate_limit_rate inject
+    503 and 429 errors, and daily_quota_after makes every call after that many fail
+    with the daily quota error. responses maps a prompt kind (chunk, merge, summary,
+    risks, chat) to a fixed response text. The same seed gives the same answers and failures.
+    Context caches are kept in memory (caches: name -> (contents, expires_at)); cached context
+    costs cached_seconds_per_1k_tokens instead of seconds_per_1k_tokens.
+    """
+    name = "fake"
+
+    def __init__(self, latency=0.0, latency_sigma=0.0, seconds_per_1k_tokens=0.0, error_rate=0.0,
+                 rate_limit_rate=0.0, daily_quota_after=None, responses=None, seed=0, cached_seconds_per_1k_tokens=0.0):
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.seconds_per_1k_tokens = seconds_per_1k_tokens
+        self.cached_seconds_per_1k_tokens = cached_seconds_per_1k_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.daily_quota_after = daily_quota_after
+        self.responses = responses or {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.call_latencies = []
+        self.caches = {}
+        self._caches_created = 0
+
+    def model_limits(self, model_name):
+        return gemini_client.KNOWN_LIMITS.get(model_name, (32768, 8192))
+
+    def create_cache(self, model_name, contents, system_instruction, ttl_seconds):
+        with self._lock:
+            self._caches_created += 1
+            name = f"cachedContents/fake-{self._caches_created}"
+            self.caches[name] = ("\n\n".join([system_instruction] + list(contents)), time.time() + ttl_seconds)
+        return name
+
+    def delete_cache(self, name):
+        with self._lock:
+            if self.caches.pop(name, None) is None:
+                raise api_exceptions.NotFound(f"Fake backend: cached content {name} not found")
+
+    def generate(self, prompt, model_name, max_output_tokens=1024, timeout=None, stream=False, schema=None,
+                 cached_content=None, usage=None):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+            draw = self._rng.random()
+            delay = self.latency * math.exp(self._rng.gauss(0, self.latency_sigma)) if self.latency else 0.0
+            cache = self.caches.get(cached_content)
+        if cached_content is not None and (cache is None or cache[1] < time.time()):
+            raise api_exceptions.NotFound(f"Fake backend: cached content {cached_content} not found")
+        delay += self.seconds_per_1k_tokens * len(prompt) / 4000
+        if cache is not None:
+            delay += self.cached_seconds_per_1k_tokens * len(cache[0]) / 4000
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise api_exceptions.DeadlineExceeded("Fake backend: deadline exceeded")
+        time.sleep(delay)
+        with self._lock:
+            self.call_latencies.append(delay)
+        if self.daily_quota_after is not None and call > self.daily_quota_after:
+            raise api_exceptions.ResourceExhausted("Quota exceeded for metric GenerateRequestsPerDayPerProjectPerModel-FreeTier")
+        if draw < self.rate_limit_rate:
+            raise api_exceptions.TooManyRequests("429 Resource has been exhausted. Please retry in 0.1s")
+        if draw < self.rate_limit_rate + self.error_rate:
+            raise api_exceptions.ServiceUnavailable("503 The service is currently unavailable")
+        text = self.respond(prompt)
+        if stream:
+            return iter(re.findall(r"\S+\s*", text))
+        return text
+
+    def respond(self, prompt):
+        kind = next((k for phrase, k in PROMPT_KINDS if phrase in prompt), "chat")
+        if kind in self.responses:
+            return self.responses[kind]
+        if kind == "chunk":
+            # One entry per "Text chunk <n>:" section of a batched chunk prompt
+            parts = re.split(r"Text chunk (\d+):\n", prompt)
+            return json.dumps({"chunks": [dict(self._chunk_answer(text), id=int(n)) for n, text in zip(parts[1::2], parts[2::2])]})
+        # Derive answers from the prompt so different chunks get different, stable summaries
+        words = re.findall(r"[A-Za-z]{4,}", prompt[-2000:])
+        quote = " ".join(words[:12])
+        if kind in ("merge", "summary"):
+            n = 5 if kind == "summary" else 10
+            return json.dumps({"summary": [{"text": f"Key point {k + 1}: {quote}", "excerpt": quote} for k in range(n)]})
+        if kind == "risks":
+            return json.dumps([{"type": t, "severity": "Medium", "excerpt": quote, "note": "Common clause."} for t in RISK_TYPES[:3]])
+        return f"Based on the excerpts, {quote.lower()} [Excerpt 1]."
+
+    @staticmethod
+    def _chunk_answer(text):
+        words = re.findall(r"[A-Za-z]{4,}", text[-2000:])
+        seed = sum(map(ord, text[-200:]))
+        risks = [{"type": RISK_TYPES[(seed + k) % len(RISK_TYPES)], "severity": SEVERITIES[(seed + k) % 3],
+                  "excerpt": " ".join(words[k * 8:k * 8 + 8]), "note": "Limits what users can do."} for k in range(2)]
+        bullets = [{"text": f"Point about {' '.join(words[k * 5:k * 5 + 5])}", "excerpt": " ".join(words[k * 5:k * 5 + 10])}
+                   for k in range(3)]
+        return {"bullets": bullets, "risks": risks}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """The process-wide backend, created from TOS_LLM_BACKEND on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = os.getenv("TOS_LLM_BACKEND", "gemini").lower()
+            _backend = FakeBackend() if name == "fake" else GeminiBackend()
+        return _backend
+
+def set_backend(backend):
+    """Replace the process-wide backend (benchmarks, scripts); returns the previous one."""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+        return previous
@@ -0,0 +1,841 @@
+# src/pipeline.py
+"""
+Document analysis pipeline, independent of any UI: text extraction, Gemini prompt runners,
+chunk summarization, consolidation and risk merging. Progress is reported through callbacks,
+so the Streamlit app, the batch CLI and scripts all share the same code path.
+"""
+import json, os, re, time, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils import extract_text_from_pdf, extract_text_from_image_bytes, sanitize_text, chunk_spans_sentence_aware, chunk_text_content_defined, estimate_tokens, text_hash, CHARS_PER_TOKEN
+from cache import AnalysisCache, DEFAULT_CACHE_PATH
+from retrieval import ChunkIndex
+from dedupe import find_near_duplicates
+from ratelimit import RequestBudget, DEFAULT_BUDGET_PATH
+from retry import CircuitBreaker, CircuitOpenError, RequestNotSent, call_with_retry, classify_error, DAILY_QUOTA, RATE_LIMITED
+import llm, tracing
+from schemas import CHUNK_BATCH_SCHEMA, SUMMARY_SCHEMA, RISKS_SCHEMA, SchemaError, validate
+
+# Max number of chunk prompts sent to Gemini at the same time
+MAX_CONCURRENT_REQUESTS = int(os.getenv("TOS_MAX_CONCURRENCY", "4"))
+# Number of summaries merged per request when consolidating large documents
+CONSOLIDATION_FAN_IN = int(os.getenv("TOS_CONSOLIDATION_FAN_IN", "8"))
+
+# Client-side request budget (Gemini free tier: 50 requests/day, 15 requests/minute)
+DAILY_REQUEST_LIMIT = int(os.getenv("TOS_DAILY_REQUEST_LIMIT", "50"))
+REQUESTS_PER_MINUTE = int(os.getenv("TOS_REQUESTS_PER_MINUTE", "15"))
+BUDGET_PATH = os.getenv("TOS_BUDGET_PATH", DEFAULT_BUDGET_PATH)
+# Retries for throttled/transient Gemini errors and the overall deadline per call (seconds)
+MAX_RETRIES = int(os.getenv("TOS_MAX_RETRIES", "4"))
+REQUEST_DEADLINE = float(os.getenv("TOS_REQUEST_DEADLINE", "120"))
+# Token planning for chunk prompts: preferred chunk size, and the output/preamble share of the context
+CHUNK_TOKENS = int(os.getenv("TOS_CHUNK_TOKENS", "6000"))
+CHUNK_OUTPUT_TOKENS = 2048
+CHUNK_PROMPT_TOKENS = 400
+CHUNK_OVERLAP_CHARS = 200
+# Several chunks share one request, since the free tier runs out of requests long before tokens.
+# A batch holds up to CHUNK_BATCH_SIZE chunks (1 = one request per chunk) and CHUNK_BATCH_TOKENS
+# input tokens, and reserves CHUNK_BATCH_OUTPUT_TOKENS of the model's output limit per chunk.
+CHUNK_BATCH_SIZE = int(os.getenv("TOS_CHUNK_BATCH_SIZE", "8"))
+CHUNK_BATCH_TOKENS = int(os.getenv("TOS_CHUNK_BATCH_TOKENS", "40000"))
+CHUNK_BATCH_OUTPUT_TOKENS = 1024
+# Sections whose estimated word-shingle similarity to an earlier section reaches this are not sent again (0 = off)
+DUPLICATE_THRESHOLD = float(os.getenv("TOS_DUPLICATE_THRESHOLD", "0.85"))
+
+# Worker processes used for page-parallel PDF extraction/OCR (default: CPU count)
+PDF_WORKERS = int(os.getenv("TOS_PDF_WORKERS", "0")) or None
+# Scanned PDFs beyond this many pages are only partially OCR'd (0 = no limit)
+OCR_MAX_PAGES = int(os.getenv("TOS_OCR_MAX_PAGES", "200")) or None
+
+# Analysis results cache. Bump PROMPT_VERSION whenever the pipeline or a prompt changes so stale
+# results are not reused; CHUNK_PROMPT_VERSION only covers the per-chunk summary prompt.
+MODEL_NAME = "gemini-1.5-flash"
+PROMPT_VERSION = "6"
+CHUNK_PROMPT_VERSION = "4"
+CACHE_ENABLED = os.getenv("TOS_CACHE_DISABLED", "").lower() not in ("1", "true", "yes")
+CACHE_PATH = os.getenv("TOS_CACHE_PATH", DEFAULT_CACHE_PATH)
+CACHE_MAX_MB = int(os.getenv("TOS_CACHE_MAX_MB", "200"))
+CACHE_MAX_AGE_DAYS = int(os.getenv("TOS_CACHE_MAX_AGE_DAYS", "30"))
+# Documents of at least this many estimated tokens are registered once as a Gemini context cache
+# for chat, kept CHAT_CACHE_TTL seconds; Gemini does not cache anything shorter than 32k tokens (0 = off)
+CHAT_CACHE_MIN_TOKENS = int(os.getenv("TOS_CHAT_CACHE_MIN_TOKENS", "32768"))
+CHAT_CACHE_TTL = int(os.getenv("TOS_CHAT_CACHE_TTL", "3600"))
+# Context caches need an explicitly versioned model
+CHAT_CACHE_MODEL = os.getenv("TOS_CHAT_CACHE_MODEL", "gemini-1.5-flash-001")
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+TEXT_EXTENSIONS = (".txt", ".md")
+SUPPORTED_EXTENSIONS = (".pdf",) + IMAGE_EXTENSIONS + TEXT_EXTENSIONS
+
+# -----------------------------
+# Shared Resources
+# -----------------------------
+# Like gemini_client, module state lives for the whole process: every Streamlit session,
+# batch worker and API job shares one rate limiter, circuit breaker and cache handle.
+_lock = threading.Lock()
+_request_budget = None
+_circuit_breaker = None
+_analysis_cache = None
+# text hash -> (context cache name or None if creating it failed, expiry time)
+_chat_caches = {}
+_chat_cache_lock = threading.Lock()
+
+def get_request_budget():
+    """One rate limiter per process; the daily count is shared with other processes through SQLite."""
+    global _request_budget
+    with _lock:
+        if _request_budget is None:
+            _request_budget = RequestBudget(BUDGET_PATH, daily_limit=DAILY_REQUEST_LIMIT, requests_per_minute=REQUESTS_PER_MINUTE)
+        return _request_budget
+
+def get_circuit_breaker():
+    """Shared by all callers so a Gemini outage pauses every caller, not just one."""
+    global _circuit_breaker
+    with _lock:
+        if _circuit_breaker is None:
+            _circuit_breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+        return _circuit_breaker
+
+def get_analysis_cache():
+    """One cache handle per process."""
+    global _analysis_cache
+    with _lock:
+        if _analysis_cache is None:
+            _analysis_cache = AnalysisCache(CACHE_PATH, max_bytes=CACHE_MAX_MB * 1024 * 1024,
+                                            max_age_seconds=CACHE_MAX_AGE_DAYS * 24 * 3600)
+        return _analysis_cache
+
+# -----------------------------
+# Text Extraction
+# -----------------------------
+def extract_document_text(path, progress_callback=None):
+    """
+    Text of a PDF, image or plain-text file, chosen by extension.
+    progress_callback(done, total, stage) is passed through to PDF extraction.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with tracing.span("extract", type=ext, bytes=os.path.getsize(path)) as info:
+        if ext == ".pdf":
+            text = extract_text_from_pdf(path, max_workers=PDF_WORKERS, progress_callback=progress_callback,
+                                         ocr_max_pages=OCR_MAX_PAGES)
+        elif ext in IMAGE_EXTENSIONS:
+            with open(path, "rb") as f:
+                text = extract_text_from_image_bytes(f.read())
+        elif ext in TEXT_EXTENSIONS:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        else:
+            raise ValueError(f"Unsupported file type: {ext or path}")
+        info["chars"] = len(text)
+    return text
+
+# -----------------------------
+# Gemini API Prompt Runner
+# -----------------------------
+BUDGET_EXHAUSTED_ERROR = {"error": "API_QUOTA_EXCEEDED", "message": "Daily request budget used up. Please try again tomorrow or upgrade your plan."}
+
+def run_gemini_prompt(prompt, model_name=MODEL_NAME, max_output_tokens=1024, schema=None):
+    """
+    Send prompt to the configured LLM backend (Gemini unless TOS_LLM_BACKEND says otherwise).
+    Returns JSON-parsed output if possible, else {'raw': ...}. With a schema (from schemas.py)
+    the model is constrained to it and the result is validated; output that still does not fit
+    (e.g. cut off at max_output_tokens) comes back as {'raw': ..., 'invalid': reason}.
+    """
+    try:
+        backend = llm.get_backend()
+        usage = {}
+        with tracing.span("llm_call", model=model_name) as info:
+            text = call_with_retry(counted_attempts(backend.generate, info, prompt, model_name, max_output_tokens=max_output_tokens,
+                                                    schema=schema, usage=usage),
+                                   breaker=get_circuit_breaker(), max_attempts=MAX_RETRIES, deadline=REQUEST_DEADLINE)
+            text = text.strip()
+            record_token_usage(info, usage, prompt, text)
+    except Exception as e:
+        return gemini_error_result(e)
+
+    with tracing.span("json_parse", chars=len(text)) as info:
+        if schema is not None:
+            try:
+                info["outcome"] = "valid"
+                return validate(json.loads(text), schema)
+            except (json.JSONDecodeError, SchemaError) as e:
+                info["outcome"] = "invalid"
+                return {"raw": text, "invalid": str(e)}
+        # Try to parse as JSON first
+        try:
+            info["outcome"] = "json"
+            return json.loads(text)
+        except json.JSONDecodeError:
+            # Try to extract JSON from the response
+            json_match = re.search(r'\{.*\}', text, re.DOTALL)
+            if json_match:
+                try:
+                    info["outcome"] = "salvaged"
+                    return json.loads(json_match.group())
+                except json.JSONDecodeError:
+                    pass
+            info["outcome"] = "raw"
+            return {"raw": text}
+
+def counted_attempts(generate, info, prompt, model_name, **kwargs):
+    """
+    fn(timeout) for call_with_retry that reserves the request budget for each attempt and records
+    attempts beyond the first as info['retries']. Runs after the circuit breaker let the attempt
+    through, so only requests actually sent count against today's budget.
+    """
+    sent = 0
+    info["retries"] = 0
+
+    def attempt(timeout):
+        nonlocal sent
+        with tracing.span("rate_limit_wait"):
+            allowed = get_request_budget().acquire()
+        if not allowed:
+            raise RequestNotSent("Daily request budget used up.")
+        sent += 1
+        info["retries"] = sent - 1
+        return generate(prompt, model_name, timeout=timeout, **kwargs)
+    return attempt
+
+def record_token_usage(info, usage, prompt, response):
+    """
+    Token counts for an LLM span: the ones the backend reported in usage (Gemini's usage_metadata),
+    or else local estimates from the prompt and response lengths, flagged with tokens_estimated.
+    """
+    if usage.get("prompt_tokens") is not None:
+        info.update(usage, tokens_estimated=False)
+    else:
+        info.update(prompt_tokens=estimate_tokens(prompt), response_tokens=estimate_tokens(response), tokens_estimated=True)
+
+def gemini_error_result(e):
+    """Map an API exception (after retries) to the {'error': ...} dict returned by the prompt runners."""
+    if isinstance(e, RequestNotSent):
+        return BUDGET_EXHAUSTED_ERROR
+    if isinstance(e, CircuitOpenError):
+        return {"error": str(e)}
+    kind, _ = classify_error(e)
+    if kind == DAILY_QUOTA:
+        return {"error": "API_QUOTA_EXCEEDED", "message": "Daily API quota exceeded. Please try again tomorrow or upgrade your plan."}
+    if kind == RATE_LIMITED:
+        # Still throttled after backing off; stop the run instead of hammering the API
+        return {"error": "API_QUOTA_EXCEEDED", "message": "API rate limit exceeded. Please wait a minute and try again."}
+    return {"error": str(e)}
+
+def stream_gemini_prompt(prompt, model_name=MODEL_NAME, max_output_tokens=1024, cached_content=None):
+    """
+    Streaming variant of run_gemini_prompt for free-text answers.
+    Yields text pieces as the model produces them; on failure the last item yielded is an
+    {'error': ...} dict (same shape as run_gemini_prompt), so callers can keep partial text.
+    cached_content names a context cache (see get_chat_cache) that the prompt follows.
+    """
+    try:
+        backend = llm.get_backend()
+        cache_args = {"cached_content": cached_content} if cached_content else {}
+        usage = {}
+        with tracing.span("llm_stream", model=model_name, cached=bool(cached_content)) as info:
+            # Only opening the stream is retried; once text has been shown, errors are reported as-is
+            pieces = call_with_retry(counted_attempts(backend.generate, info, prompt, model_name,
+                                                      max_output_tokens=max_output_tokens, stream=True, usage=usage, **cache_args),
+                                     breaker=get_circuit_breaker(), max_attempts=MAX_RETRIES, deadline=REQUEST_DEADLINE)
+            response = []
+            for piece in pieces:
+                response.append(piece)
+                yield piece
+            record_token_usage(info, usage, prompt, "".join(response))
+    except Exception as e:
+        yield gemini_error_result(e)
+
+def run_prompts_concurrently(prompts, max_output_tokens=1024, max_workers=None, on_result=None, schema=None):
+    """
+    Run prompts on a bounded thread pool.
+    Returns (results in prompt order, quota_exceeded). on_result(index, result) is called
+    from the calling thread as prompts finish. The first API_QUOTA_EXCEEDED cancels the prompts
+    not started yet; prompts already in flight still deliver their results.
+    """
+    results = [None] * len(prompts)
+    if not prompts:
+        return results, False
+    quota_hit = threading.Event()
+
+    def run(prompt):
+        # Skip prompts that were still queued when the quota ran out
+        if quota_hit.is_set():
+            return {"error": "API_QUOTA_EXCEEDED"}
+        res = run_gemini_prompt(prompt, max_output_tokens=max_output_tokens, schema=schema)
+        if isinstance(res, dict) and res.get("error") == "API_QUOTA_EXCEEDED":
+            quota_hit.set()
+        return res
+
+    workers = max(1, min(max_workers or MAX_CONCURRENT_REQUESTS, len(prompts)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {executor.submit(tracing.in_context(run), prompt): i for i, prompt in enumerate(prompts)}
+    try:
+        # Callbacks run on this thread, so UI code can update its elements from them
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            res = future.result()
+            if isinstance(res, dict) and res.get("error") == "API_QUOTA_EXCEEDED":
+                for queued in futures:
+                    queued.cancel()
+                continue
+            results[futures[future]] = res
+            if on_result:
+                on_result(futures[future], res)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results, quota_hit.is_set()
+
+# -----------------------------
+# Cache Keys
+# -----------------------------
+def analysis_cache_key(sanitized_text):
+    return f"{text_hash(sanitized_text)}:{MODEL_NAME}:v{PROMPT_VERSION}"
+
+def chunk_cache_key(chunk):
+    return f"chunk:{text_hash(chunk)}:{MODEL_NAME}:v{CHUNK_PROMPT_VERSION}"
+
+# -----------------------------
+# Consolidation
+# -----------------------------
+def consolidate_summaries(summaries, fan_in=None, max_workers=None, on_progress=None, memo=None, on_merged=None):
+    """
+    Tree-reduce summaries: merge groups of fan_in summaries in parallel, level by level,
+    until a single prompt can produce the final 5-bullet summary.
+    memo maps a group's hash to its merged summary; finished merges are added to it so an
+    interrupted run can resume without repeating them, and on_merged() is called after each one
+    (e.g. to save memo). on_progress(message) reports each level.
+    Returns the final {"summary": [...]} result, or an API_QUOTA_EXCEEDED error dict.
+    """
+    memo = {} if memo is None else memo
+    fan_in = max(2, fan_in or CONSOLIDATION_FAN_IN)
+    level = 1
+    while len(summaries) > fan_in:
+        groups = [summaries[i:i + fan_in] for i in range(0, len(summaries), fan_in)]
+        if on_progress is not None:
+            on_progress(f"🧩 Merging {len(summaries)} summaries into {len(groups)} (level {level})...")
+        keys = [text_hash(json.dumps(group, sort_keys=True)) for group in groups]
+        todo = [k for k, key in enumerate(keys) if key not in memo]
+        prompts = [f"""You are merging partial summaries from a Terms of Service document analysis.
+
+Combine the summaries below into one list of the key points users should know.
+Merge similar points, remove duplicates, and keep every distinct point about data privacy, user rights,
+payments, legal obligations, or concerning clauses. Keep at most 10 bullet points.
+
+Output ONLY valid JSON: {{"summary": [{{"text":"<clear bullet point>","excerpt":"<supporting quote>"}}]}}
+
+Summaries to merge:
+{json.dumps(groups[k])}""" for k in todo]
+
+        def on_merge_done(j, res):
+            if not (isinstance(res, dict) and "error" in res):
+                memo[keys[todo[j]]] = res
+                if on_merged is not None:
+                    on_merged()
+
+        merged, quota_exceeded = run_prompts_concurrently(prompts, max_output_tokens=1024, max_workers=max_workers,
+                                                          on_result=on_merge_done, schema=SUMMARY_SCHEMA)
+        if quota_exceeded:
+            return {"error": "API_QUOTA_EXCEEDED"}
+        fresh = dict(zip(todo, merged))
+        summaries = [memo[key] if key in memo else fresh[k] for k, key in enumerate(keys)]
+        level += 1
+
+    if on_progress is not None:
+        on_progress("🧩 Writing the final summary...")
+    combine_prompt = f"""You are consolidating summaries from a Terms of Service document analysis.
+
+Review all the chunk summaries below and create a comprehensive list of key points that users should know. 
+Combine similar points, remove duplicates, and prioritize the most important information.
+
+Focus on creating exactly 5 clear, actionable bullet points that cover:
+- Data privacy and sharing policies
+- User rights and account management
+- Payment and billing terms
+- Legal obligations and limitations
+- Any concerning clauses users should be aware of
+
+Output ONLY valid JSON: {{"summary": [{{"text":"<clear bullet point>","excerpt":"<supporting quote>"}}]}}
+
+Chunk summaries to consolidate:
+{json.dumps(summaries)}"""
+    return run_gemini_prompt(combine_prompt, max_output_tokens=1024, schema=SUMMARY_SCHEMA)
+
+# -----------------------------
+# Risk Merging
+# -----------------------------
+SEVERITY_RANK = {"High": 3, "Medium": 2, "Low": 1}
+
+def _risk_words(risk):
+    return set(re.findall(r"\w+", f"{risk.get('excerpt', '')} {risk.get('note', '')}".lower()))
+
+def merge_chunk_risks(chunk_summaries, max_risks=10, similarity=0.5):
+    """
+    Collect the risks found in every chunk, drop near-duplicates of the same type
+    (word overlap above similarity), and rank by severity, then by how many chunks raised that type.
+    """
+    candidates = []
+    for summary in chunk_summaries:
+        if isinstance(summary, dict) and isinstance(summary.get("risks"), list):
+            for risk in summary["risks"]:
+                if isinstance(risk, dict) and risk.get("type"):
+                    severity = str(risk.get("severity", "Low")).strip().capitalize()
+                    candidates.append(dict(risk, severity=severity if severity in SEVERITY_RANK else "Low"))
+
+    type_counts = {}
+    for risk in candidates:
+        key = risk["type"].strip().lower()
+        type_counts[key] = type_counts.get(key, 0) + 1
+
+    # Highest severity first, so the copy we keep for each duplicate group is the most severe one
+    candidates.sort(key=lambda r: (-SEVERITY_RANK[r["severity"]], -type_counts[r["type"].strip().lower()]))
+    merged = []
+    for risk in candidates:
+        words = _risk_words(risk)
+        duplicate = False
+        for kept, kept_words in merged:
+            if kept["type"].strip().lower() != risk["type"].strip().lower():
+                continue
+            overlap = len(words & kept_words) / max(1, len(words | kept_words))
+            if overlap >= similarity:
+                duplicate = True
+                break
+        if not duplicate:
+            merged.append((risk, words))
+    return [risk for risk, _ in merged[:max_risks]]
+
+# -----------------------------
+# Chunk Batching
+# -----------------------------
+def pack_chunk_batches(chunks, max_tokens=None, model_name=MODEL_NAME):
+    """
+    Group (number, chunk) pairs into runs of consecutive chunks sent as one request each.
+    A batch stays within max_tokens of input (default CHUNK_BATCH_TOKENS), CHUNK_BATCH_SIZE chunks
+    and the model's output limit; a chunk bigger than max_tokens gets a batch of its own.
+    """
+    input_limit, output_limit = llm.get_backend().model_limits(model_name)
+    max_tokens = min(max_tokens or CHUNK_BATCH_TOKENS, input_limit) - CHUNK_PROMPT_TOKENS
+    max_size = max(1, min(CHUNK_BATCH_SIZE, output_limit // CHUNK_BATCH_OUTPUT_TOKENS))
+    batches, size = [], 0
+    for item in chunks:
+        tokens = estimate_tokens(item[1])
+        if batches and len(batches[-1]) < max_size and size + tokens <= max_tokens:
+            batches[-1].append(item)
+            size += tokens
+        else:
+            batches.append([item])
+            size = tokens
+    return batches
+
+def chunk_batch_prompt(batch):
+    chunk_texts = "\n\n".join(f"Text chunk {i}:\n{c}" for i, c in batch)
+    return f"""You are a helpful assistant that extracts key information from Terms of Service documents for regular users.
+
+Analyze each numbered text chunk below on its own and extract important points that users should know about. Look for:
+- Data privacy and sharing policies
+- User rights and limitations  
+- Payment and billing terms
+- Account termination policies
+- Legal obligations and liabilities
+- Any concerning or important clauses
+
+Also list any clauses in each chunk that are risky for users, such as data sharing or selling, account termination,
+arbitration or class action waivers, liability limitations, automatic renewals or hidden fees, broad content licenses,
+or changes without notice. Rate each risk Low/Medium/High by its potential impact on users.
+
+Output ONLY valid JSON with exactly one entry per chunk, using the chunk's number as its id:
+{{"chunks":[{{"id":<chunk number>,
+"bullets":[{{"text":"<clear explanation ≤200 chars>","excerpt":"<relevant quote from that chunk (≤150 chars)>"}}],
+"risks":[{{"type":"<risk category, e.g. Data Sharing>","severity":"<Low/Medium/High>","excerpt":"<direct quote (≤200 chars)>","note":"<why this matters to users>"}}]}}]}}
+
+If a chunk is unclear or contains no meaningful content, give it an entry with empty "bullets" and "risks" lists.
+
+{chunk_texts}"""
+
+def split_batch_result(batch, res):
+    """
+    {number: summary} for every chunk of batch, from the batched response res.
+    Chunks the response does not cover get res itself if it is an error or unreadable,
+    else an {'raw': ..., 'invalid': ...} result of their own.
+    """
+    entries = {}
+    if isinstance(res, dict) and "chunks" in res:
+        for entry in res["chunks"]:
+            entries.setdefault(entry.pop("id"), entry)
+        if len(batch) == 1 and len(entries) == 1:
+            # A lone chunk takes the only entry, whatever number the model gave it
+            entries = {batch[0][0]: next(iter(entries.values()))}
+    summaries = {}
+    for i, _ in batch:
+        if i in entries:
+            summaries[i] = entries[i]
+        elif isinstance(res, dict) and ("error" in res or "raw" in res):
+            summaries[i] = res
+        else:
+            summaries[i] = {"raw": json.dumps(res), "invalid": f"no entry for chunk {i}"}
+    return summaries
+
+# -----------------------------
+# Analyze Text
+# -----------------------------
+def plan_chunk_chars(text, model_name=MODEL_NAME):
+    """
+    Size chunk prompts by estimated tokens against the model's context.
+    Returns (max_chars, hard_cap_chars): max_chars puts the whole text in one chunk when it fits
+    in CHUNK_TOKENS, otherwise gives CHUNK_TOKENS-sized chunks; hard_cap_chars is the most one
+    prompt can hold, used when the request budget forces even fewer calls.
+    """
+    input_limit, _ = llm.get_backend().model_limits(model_name)
+    hard_cap_tokens = max(1000, input_limit - CHUNK_PROMPT_TOKENS - CHUNK_OUTPUT_TOKENS)
+    chunk_tokens = min(CHUNK_TOKENS, hard_cap_tokens)
+    hard_cap_chars = hard_cap_tokens * CHARS_PER_TOKEN
+    if estimate_tokens(text) <= chunk_tokens:
+        # Big enough that neither a forced nor a content-defined cut can happen
+        return 2 * (len(text) + CHUNK_OVERLAP_CHARS + 1), hard_cap_chars
+    return chunk_tokens * CHARS_PER_TOKEN, hard_cap_chars
+
+def preview_analysis_plan(full_text):
+    """(chunks, requests, estimated tokens) for a fresh analysis of full_text."""
+    full_text = sanitize_text(full_text)
+    max_chars, _ = plan_chunk_chars(full_text)
+    chunks = chunk_text_content_defined(full_text, max_chars=max_chars, overlap_chars=CHUNK_OVERLAP_CHARS)
+    duplicates = find_near_duplicates(chunks, threshold=DUPLICATE_THRESHOLD) if DUPLICATE_THRESHOLD > 0 else {}
+    unique = [(i, c) for i, c in enumerate(chunks, start=1) if i - 1 not in duplicates]
+    return len(chunks), estimate_analysis_calls(len(pack_chunk_batches(unique)), len(unique)), estimate_tokens(full_text)
+
+def estimate_analysis_calls(chunk_requests, total_chunks, fan_in=None):
+    """Requests an analysis needs: the chunk batches still to send plus every consolidation level."""
+    fan_in = max(2, fan_in or CONSOLIDATION_FAN_IN)
+    calls = chunk_requests
+    remaining = total_chunks
+    while remaining > fan_in:
+        remaining = -(-remaining // fan_in)
+        calls += remaining
+    # Final summary; the optional risk fallback prompt is not reserved
+    return calls + 1
+
+def analyze_text(full_text, max_workers=None, use_cache=None, on_plan=None, on_progress=None):
+    """
+    Summarize full_text and collect its risks. use_cache defaults to CACHE_ENABLED (TOS_CACHE_DISABLED).
+    on_plan(plan) is called once the run is planned, with the text size, chunk, duplicate and request counts;
+    on_progress(message, fraction) reports each step, fraction being the share of chunks done (or None).
+    Both are called from the calling thread. Errors come back as {'error': ..., 'message': ...} results.
+    The result's 'trace' holds the timing spans of this run (joined to the caller's trace, if one is active).
+    """
+    if use_cache is None:
+        use_cache = CACHE_ENABLED
+    with tracing.start_trace("analysis") as trace:
+        result = _analyze_text(full_text, max_workers, use_cache, on_plan, on_progress)
+    result["trace"] = trace.to_dict()
+    return result
+
+def _analyze_text(full_text, max_workers, use_cache, on_plan, on_progress):
+    raw_tokens = estimate_tokens(full_text)
+    with tracing.span("sanitize", chars_in=len(full_text)) as info:
+        full_text = sanitize_text(full_text)
+        info["chars_out"] = len(full_text)
+    tokens_saved = max(0, raw_tokens - estimate_tokens(full_text))
+    t0 = time.time()
+
+    cache = get_analysis_cache() if use_cache else None
+    cache_key = analysis_cache_key(full_text)
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            cached["cached"] = True
+            cached["time"] = round(time.time() - t0, 1)
+            return cached
+
+    # Checkpoint of an earlier run on this exact text that stopped partway (quota, errors).
+    # Kept even when the cache is bypassed, and removed once the analysis completes.
+    store = get_analysis_cache()
+    checkpoint_key = f"checkpoint:{cache_key}"
+    checkpoint = store.get(checkpoint_key, counter=None) or {"chunks": {}, "merges": {}}
+    resuming = bool(checkpoint["chunks"] or checkpoint["merges"] or "combined" in checkpoint)
+
+    def save_checkpoint():
+        store.put(checkpoint_key, checkpoint)
+
+    def lookup_chunks(chunks):
+        # Reuse summaries of chunks finished by an interrupted run on this text, or already seen
+        # in an earlier analysis (e.g. a previous ToS revision)
+        summaries = [None] * len(chunks)
+        pending = []
+        for i, c in enumerate(chunks, start=1):
+            memo = checkpoint["chunks"].get(text_hash(c))
+            if memo is None and cache is not None:
+                memo = cache.get(chunk_cache_key(c), counter=None)
+            if memo is not None:
+                summaries[i - 1] = memo
+            else:
+                pending.append((i, c))
+        return summaries, pending
+
+    # Plan the run against today's request budget: use larger chunks until it fits, or refuse up front.
+    # Content-defined boundaries keep unchanged sections byte-identical across document revisions.
+    # A resumed run keeps the chunk size it started with so its finished chunks still match.
+    remaining = get_request_budget().remaining_today()
+    planned_chars, hard_cap_chars = plan_chunk_chars(full_text)
+    max_chars = checkpoint.get("max_chars", planned_chars)
+    while True:
+        with tracing.span("chunk", max_chars=max_chars) as info:
+            chunks = chunk_text_content_defined(full_text, max_chars=max_chars, overlap_chars=CHUNK_OVERLAP_CHARS)
+            info["chunks"] = len(chunks)
+        chunk_summaries, pending = lookup_chunks(chunks)
+        # Repeated sections (the same clause in the terms and an addendum) reuse the earlier copy's summary
+        with tracing.span("dedupe", chunks=len(chunks)) as info:
+            duplicates = find_near_duplicates(chunks, threshold=DUPLICATE_THRESHOLD) if DUPLICATE_THRESHOLD > 0 else {}
+            info["duplicates"] = len(duplicates)
+        skipped = sum(1 for i, _ in pending if i - 1 in duplicates)
+        pending = [(i, c) for i, c in pending if i - 1 not in duplicates]
+        # Batches grow with the chunks, so larger chunks also mean fewer chunk requests
+        batch_tokens = max(CHUNK_BATCH_TOKENS, CHUNK_BATCH_TOKENS * max_chars // planned_chars)
+        chunk_requests = len(pack_chunk_batches(pending, max_tokens=batch_tokens))
+        if "combined" in checkpoint and checkpoint.get("max_chars") == max_chars:
+            planned_calls = chunk_requests
+        else:
+            planned_calls = estimate_analysis_calls(chunk_requests, len(chunks) - len(duplicates))
+        if planned_calls <= remaining or max_chars >= hard_cap_chars or len(chunks) <= 1:
+            break
+        max_chars = min(max_chars * 2, hard_cap_chars)
+    if cache is not None:
+        cache.record("chunk_", len(chunks) - len(pending) - skipped, len(pending))
+    if checkpoint.get("max_chars") != max_chars:
+        # Finished merges belong to the old chunking
+        checkpoint.update(max_chars=max_chars, merges={})
+        checkpoint.pop("combined", None)
+
+    if planned_calls > remaining:
+        message = (f"This document needs about {planned_calls} AI requests, but only {remaining} of today's "
+                   f"{DAILY_REQUEST_LIMIT} are left. Please try again tomorrow or upgrade your plan.")
+        return {"error": "BUDGET_EXCEEDED", "message": message, "chunks": [], "combined": {"summary": []}, "risks": [], "time": 0}
+    
+    if on_plan is not None:
+        on_plan({"text_chars": len(full_text), "tokens": estimate_tokens(full_text), "tokens_saved": tokens_saved,
+                 "chunks": len(chunks), "duplicates": len(duplicates), "skipped": skipped,
+                 "planned_calls": planned_calls, "remaining_requests": remaining})
+
+    def report(message, fraction=None):
+        if on_progress is not None:
+            on_progress(message, fraction)
+
+    # Summarize chunks concurrently, keeping results in chunk order
+    reused = len(chunks) - len(pending) - skipped
+    done = len(chunks) - len(pending)
+    if resuming:
+        report(f"⏯️ Resuming an interrupted analysis: {reused} section(s) already done, {len(pending)} to go...",
+               done / max(1, len(chunks)))
+    elif reused or skipped:
+        report(f"♻️ Reused {reused} unchanged and skipped {skipped} repeated section(s), analyzing {len(pending)} new...",
+               done / max(1, len(chunks)))
+
+
+    def on_chunk_done(i, c, res):
+        nonlocal done
+        chunk_summaries[i - 1] = res
+        if not (isinstance(res, dict) and "error" in res):
+            checkpoint["chunks"][text_hash(c)] = res
+            if cache is not None:
+                cache.put(chunk_cache_key(c), res)
+        done += 1
+        report(f"🔍 Analyzing section {done} of {len(chunks)}...", done / len(chunks))
+
+    # Several chunks per request. The chunks a batch's output misses (cut off, unreadable or skipping
+    # a chunk) are split in two and sent again, until a lone chunk's failure is its result. An API
+    # error is every chunk's result right away: resending cannot fix a bad key or an outage.
+    batches = pack_chunk_batches(pending, max_tokens=batch_tokens)
+    output_limit = llm.get_backend().model_limits(MODEL_NAME)[1]
+    quota_exceeded = False
+    while batches:
+        retry = []
+
+        def on_batch_done(k, res):
+            batch = batches[k]
+            summaries = split_batch_result(batch, res)
+            failed = []
+            for i, c in batch:
+                summary = summaries[i]
+                if len(batch) > 1 and isinstance(summary, dict) and "raw" in summary:
+                    failed.append((i, c))
+                else:
+                    on_chunk_done(i, c, summary)
+            if failed:
+                half = -(-len(failed) // 2)
+                retry.extend(b for b in (failed[:half], failed[half:]) if b)
+            # Saved per request, so an interrupt partway through this stage keeps the chunks already done
+            if len(failed) < len(batch):
+                save_checkpoint()
+
+        _, quota_exceeded = run_prompts_concurrently([chunk_batch_prompt(b) for b in batches], max_output_tokens=output_limit,
+                                                     max_workers=max_workers, on_result=on_batch_done, schema=CHUNK_BATCH_SCHEMA)
+        if quota_exceeded:
+            break
+        if retry:
+            report(f"✂️ Retrying {sum(map(len, retry))} section(s) in smaller batches...", done / len(chunks))
+        batches = retry
+    if quota_exceeded:
+        save_checkpoint()
+        completed = [s for s in chunk_summaries if s is not None]
+        return {"error": "API_QUOTA_EXCEEDED", "message": "API quota exceeded. Analysis stopped.", "chunks": completed, "combined": {"summary": []}, "risks": [], "time": 0, "resumable": True}
+    save_checkpoint()
+    for dup, original in duplicates.items():
+        if chunk_summaries[dup] is None:
+            chunk_summaries[dup] = chunk_summaries[original]
+
+    # Consolidate summaries (tree-reduce for large documents)
+    if "combined" in checkpoint:
+        combined = checkpoint["combined"]
+    else:
+        # Risks are merged locally below, so only the bullets go into consolidation, once per repeated section
+        bullet_summaries = [{"bullets": s.get("bullets", [])} if isinstance(s, dict) else s
+                            for k, s in enumerate(chunk_summaries) if k not in duplicates]
+        with tracing.span("consolidate", summaries=len(bullet_summaries)):
+            combined = consolidate_summaries(bullet_summaries, max_workers=max_workers, on_progress=report,
+                                             memo=checkpoint["merges"], on_merged=save_checkpoint)
+        if isinstance(combined, dict) and combined.get("error") == "API_QUOTA_EXCEEDED":
+            save_checkpoint()
+            return {"error": "API_QUOTA_EXCEEDED", "message": "API quota exceeded during consolidation.", "chunks": chunk_summaries, "combined": {"summary": []}, "risks": [], "time": 0, "resumable": True}
+        chunks_failed = any(isinstance(r, dict) and "error" in r for r in chunk_summaries)
+        if not chunks_failed and not (isinstance(combined, dict) and "error" in combined):
+            checkpoint["combined"] = combined
+            save_checkpoint()
+
+    # Risk detection: merge, dedupe and rank the risks found in each chunk
+    with tracing.span("merge_risks"):
+        risks = merge_chunk_risks(chunk_summaries)
+
+    # Chunk risks come back schema-validated, so a short list is normally the document's real answer.
+    # Only spend a request on the simpler prompt when nothing was found, or some chunk could not be read.
+    unreadable = any(isinstance(s, dict) and "raw" in s for s in chunk_summaries)
+    if not risks or (len(risks) < 3 and unreadable):
+        fallback_prompt = f"""Find at least 3 potential concerns in this Terms of Service document. Even common clauses can be risks.
+
+Look for ANY of these standard clauses that limit user rights:
+- Data collection/sharing policies
+- Account termination rights
+- Service modification rights
+- Liability limitations
+- Dispute resolution methods
+- Content ownership claims
+- Geographic restrictions
+- Automatic renewals
+
+Output as JSON array with exactly 3 risks:
+[{{"type":"[Risk Type]","severity":"[Low/Medium/High]","excerpt":"[quote from text]","note":"[why this matters]"}}]
+
+Document: {full_text[:2000]}..."""
+        
+        fallback_risks = run_gemini_prompt(fallback_prompt, max_output_tokens=512, schema=RISKS_SCHEMA)
+        if isinstance(fallback_risks, list) and fallback_risks:
+            risks = merge_chunk_risks([{"risks": risks + fallback_risks}])
+        if len(risks) == 0:
+            # Ultimate fallback - provide generic risks if nothing found
+            risks = [
+                {
+                    "type": "Data Collection",
+                    "severity": "Medium", 
+                    "excerpt": "Standard data collection practices",
+                    "note": "Most services collect user data - review privacy policy for details"
+                },
+                {
+                    "type": "Account Termination",
+                    "severity": "Low",
+                    "excerpt": "Service provider reserves termination rights",
+                    "note": "Your account could be terminated for policy violations"
+                },
+                {
+                    "type": "Service Changes",
+                    "severity": "Low",
+                    "excerpt": "Terms may be updated without notice",
+                    "note": "Service terms can change - check periodically for updates"
+                }
+            ]
+
+    t1 = time.time()
+    result = {"chunks": chunk_summaries, "combined": combined, "risks": risks, "time": round(t1-t0,1), "reused_chunks": reused,
+              "duplicate_chunks": len(duplicates), "tokens_saved": tokens_saved}
+    # Only cache clean runs so transient API errors are retried next time
+    failed = any(isinstance(r, dict) and "error" in r for r in chunk_summaries + [combined])
+    if not failed:
+        store.delete(checkpoint_key)
+    if cache is not None and not failed:
+        cache.put(cache_key, result)
+    result["cached"] = False
+    return result
+
+# -----------------------------
+# Chat
+# -----------------------------
+CHAT_SYSTEM_INSTRUCTION = """You are a helpful assistant that answers questions about the Terms of Service document below, for regular users.
+Answer from the document, quoting the short passage your answer relies on. If the document does not cover the question, say so.
+Keep your answers concise but informative."""
+
+def get_chat_cache(full_text, summary=None, model_name=CHAT_CACHE_MODEL):
+    """
+    Name of a context cache holding full_text and its summary points for chat prompts, or None
+    when the document is too short to cache or the cache could not be created (e.g. on the free tier).
+    Created on the first question and shared by every session asking about the same document.
+    """
+    text = sanitize_text(full_text)
+    tokens = estimate_tokens(text)
+    if CHAT_CACHE_MIN_TOKENS <= 0 or tokens < CHAT_CACHE_MIN_TOKENS:
+        return None
+    key = text_hash(text)
+    with _chat_cache_lock:
+        name, expires = _chat_caches.get(key, (None, 0))
+    # Leave a minute so a question asked just before expiry does not hit a deleted cache
+    if expires - 60 > time.time():
+        return name
+    contents = [f"TERMS OF SERVICE DOCUMENT:\n{text}"]
+    points = [p.get("text", "") for p in (summary or {}).get("summary", []) if isinstance(p, dict)]
+    if points:
+        contents.append("KEY POINTS FROM AN EARLIER ANALYSIS:\n" + "\n".join(f"- {p}" for p in points))
+    # Created without holding the lock, so one slow request does not stall chat in other sessions
+    with tracing.span("chat_cache", tokens=tokens) as info:
+        try:
+            name = llm.get_backend().create_cache(model_name, contents, CHAT_SYSTEM_INSTRUCTION, CHAT_CACHE_TTL)
+            expires = time.time() + CHAT_CACHE_TTL
+        except Exception as e:
+            print(f"Chat cache error: {e}")
+            info["error"] = type(e).__name__
+            # Don't retry on every question
+            name, expires = None, time.time() + 600
+    with _chat_cache_lock:
+        other, other_expires = _chat_caches.get(key, (None, 0))
+        if other and other_expires - 60 > time.time():
+            # Another session created one meanwhile; keep theirs
+            duplicate, name = name, other
+        else:
+            duplicate = None
+            _chat_caches[key] = (name, expires)
+    if duplicate:
+        _delete_chat_cache(duplicate)
+    return name
+
+def chat_cache_missing(result):
+    """Whether an {'error': ...} result says the context cache is gone (deleted or expired)."""
+    error = str(result.get("error", "")) if isinstance(result, dict) else ""
+    return bool(re.search(r"\b404\b|not found|expired", error, re.IGNORECASE))
+
+def forget_chat_cache(cache_name):
+    """
+    Drop cache_name (e.g. after a prompt found it missing) so the next question creates a new one,
+    and delete it on Gemini's side in case it still exists, since it is billed until it expires.
+    """
+    with _chat_cache_lock:
+        for key, (name, _) in list(_chat_caches.items()):
+            if name == cache_name:
+                del _chat_caches[key]
+    _delete_chat_cache(cache_name)
+
+def _delete_chat_cache(cache_name):
+    try:
+        llm.get_backend().delete_cache(cache_name)
+    except Exception as e:
+        # Already gone, or it expires on its own at the end of its TTL
+        print(f"Chat cache delete error: {e}")
+
+def build_chat_index(full_text):
+    """Retrieval index over small chunks of the sanitized text, plus each chunk's (start, end) offsets."""
+    text = sanitize_text(full_text)
+    spans = chunk_spans_sentence_aware(text, max_chars=1000, overlap_chars=100)
+    return ChunkIndex([text[start:end] for start, end in spans]), spans
@@ -0,0 +1,82 @@
+# src/ratelimit.py
+import sqlite3, os, time, threading
+from contextlib import contextmanager
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+DEFAULT_BUDGET_PATH = os.path.join(os.path.expanduser("~"), ".cache", "tos-decoder", "budget.sqlite3")
+
+# Gemini free-tier daily quotas reset at midnight Pacific time
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+class RequestBudget:
+    """
+    Client-side limiter for Gemini requests.
+    A token bucket spaces calls to at most requests_per_minute, and a daily counter
+    persisted in SQLite (shared by every session and process using the same file)
+    stops calls once daily_limit requests were made in the current quota day.
+    """
+
+    def __init__(self, path=DEFAULT_BUDGET_PATH, daily_limit=50, requests_per_minute=15):
+        self.path = path
+        self.daily_limit = daily_limit
+        requests_per_minute = max(1, requests_per_minute)
+        self.rate = requests_per_minute / 60.0
+        self.capacity = requests_per_minute
+        self._tokens = float(self.capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS usage (day TEXT PRIMARY KEY, count INTEGER NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _today(self):
+        return datetime.now(QUOTA_TIMEZONE).strftime("%Y-%m-%d")
+
+    def used_today(self):
+        with self._connect() as conn:
+            row = conn.execute("SELECT count FROM usage WHERE day = ?", (self._today(),)).fetchone()
+        return row[0] if row else 0
+
+    def remaining_today(self):
+        return max(0, self.daily_limit - self.used_today())
+
+    def _reserve_daily(self):
+        """Atomically count one request against today's budget; False if it is used up."""
+        day = self._today()
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO usage (day, count) VALUES (?, 0)", (day,))
+            cur = conn.execute("UPDATE usage SET count = count + 1 WHERE day = ? AND count < ?", (day, self.daily_limit))
+            return cur.rowcount == 1
+
+    def _take_token(self):
+        """Block until the token bucket allows another request."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def acquire(self):
+        """
+        Wait for a rate-limit slot and reserve one request from the daily budget.
+        Returns False without waiting if the daily budget is already exhausted.
+        """
+        if not self._reserve_daily():
+            return False
+        self._take_token()
+        return True
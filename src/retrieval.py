@@ -0,0 +1,71 @@
+# src/retrieval.py
+import math, re
+from collections import Counter
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Very common words carry no signal for ranking legal clauses
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "has", "have",
+    "i", "if", "in", "is", "it", "my", "of", "on", "or", "that", "the", "their", "they", "this", "to",
+    "we", "what", "when", "will", "with", "you", "your",
+}
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+class ChunkIndex:
+    """
+    In-memory BM25 index over document chunks.
+    Postings are kept per term as NumPy arrays, so scoring a query is a handful of
+    vectorized operations over the chunks that actually contain each query term.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = list(chunks)
+        self.k1 = k1
+        self.b = b
+        doc_terms = [Counter(tokenize(c)) for c in self.chunks]
+        self.doc_len = np.array([sum(tf.values()) for tf in doc_terms], dtype=np.float32)
+        self.avg_len = float(self.doc_len.mean()) if len(self.chunks) else 0.0
+
+        postings = {}
+        for doc_id, tf in enumerate(doc_terms):
+            for term, count in tf.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc_id)
+                postings[term][1].append(count)
+        n_docs = len(self.chunks)
+        self.postings = {}
+        for term, (doc_ids, counts) in postings.items():
+            idf = math.log(1 + (n_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            self.postings[term] = (np.array(doc_ids, dtype=np.int32), np.array(counts, dtype=np.float32), idf)
+
+    def scores(self, query):
+        """BM25 score of every chunk for query."""
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        if not self.chunks:
+            return scores
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / max(self.avg_len, 1e-9))
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            doc_ids, tf, idf = self.postings[term]
+            scores[doc_ids] += idf * tf * (self.k1 + 1) / (tf + norm[doc_ids])
+        return scores
+
+    def search(self, query, k=4):
+        """
+        Return up to k (chunk_index, chunk_text, score) tuples, best first.
+        Falls back to the opening chunks when no query term occurs in the document.
+        """
+        scores = self.scores(query)
+        k = min(k, len(self.chunks))
+        if k == 0:
+            return []
+        if not scores.any():
+            return [(i, self.chunks[i], 0.0) for i in range(k)]
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), self.chunks[i], float(scores[i])) for i in top if scores[i] > 0]
@@ -0,0 +1,140 @@
+# src/retry.py
+import random, re, threading, time
+from google.api_core import exceptions as api_exceptions
+
+# Error classes returned by classify_error
+DAILY_QUOTA = "daily_quota"      # quota for the day is gone, retrying cannot help
+RATE_LIMITED = "rate_limited"    # per-minute throttling, retry after the hinted delay
+TRANSIENT = "transient"          # 5xx, timeouts, dropped connections
+FATAL = "fatal"                  # bad request, auth, safety blocks...
+
+TRANSIENT_EXCEPTIONS = (
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.Aborted,
+    ConnectionError,
+    TimeoutError,
+)
+
+RETRY_DELAY_RE = re.compile(r"retry in\s*(\d+(?:\.\d+)?)\s*(ms|s)\b|retry_delay\s*\{\s*seconds:\s*(\d+(?:\.\d+)?)",
+                            re.IGNORECASE)
+
+def retry_after_seconds(error_msg):
+    """
+    Server-suggested delay in seconds from messages like 'Please retry in 27.3s', 'Please retry in 519.7ms'
+    or 'retry_delay { seconds: 27 }'; None when the message carries no delay.
+    """
+    match = RETRY_DELAY_RE.search(error_msg)
+    if not match:
+        return None
+    amount, unit, seconds = match.groups()
+    try:
+        if seconds is not None:
+            return float(seconds)
+        return float(amount) / 1000 if unit.lower() == "ms" else float(amount)
+    except ValueError:
+        return None
+
+def classify_error(e):
+    """Return (error class, retry-after seconds or None) for an exception raised by the Gemini SDK."""
+    error_msg = str(e)
+    lowered = error_msg.lower()
+    if isinstance(e, (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests)) \
+            or "429" in error_msg or "quota" in lowered or "rate limit" in lowered or "resource exhausted" in lowered:
+        # Quota violations name the limit, e.g. GenerateRequestsPerDayPerProjectPerModel-FreeTier
+        if "perday" in lowered or "per day" in lowered or "daily" in lowered:
+            return DAILY_QUOTA, None
+        return RATE_LIMITED, retry_after_seconds(error_msg)
+    if isinstance(e, TRANSIENT_EXCEPTIONS) or re.search(r"\b50[0-4]\b", error_msg) or "timed out" in lowered:
+        return TRANSIENT, retry_after_seconds(error_msg)
+    return FATAL, None
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+class RequestNotSent(Exception):
+    """Raised by call_with_retry's fn when it gave up before sending (e.g. no request budget left)."""
+
+class CircuitBreaker:
+    """
+    Fails fast after failure_threshold consecutive retryable failures, then lets a single
+    trial call through once reset_timeout seconds have passed (half-open).
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def release(self):
+        """Let another trial call through when the one allowed did not reach the API."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+def call_with_retry(fn, breaker=None, max_attempts=4, base_delay=1.0, max_delay=30.0, deadline=120.0):
+    """
+    Call fn(timeout) until it succeeds, retrying rate-limited and transient errors with
+    exponential backoff and full jitter (or the server's retry-after hint, if given).
+    timeout is what is left of the overall deadline, for use as the per-request timeout.
+    Daily-quota and fatal errors, open circuits and exhausted retries re-raise the last error;
+    RequestNotSent from fn is re-raised without counting for or against the breaker.
+    """
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError("Gemini API is failing repeatedly; pausing requests for a moment.")
+        attempt += 1
+        remaining = deadline - (time.monotonic() - start)
+        try:
+            result = fn(max(1.0, remaining))
+        except RequestNotSent:
+            if breaker is not None:
+                breaker.release()
+            raise
+        except Exception as e:
+            kind, retry_after = classify_error(e)
+            if breaker is not None:
+                if kind in (RATE_LIMITED, TRANSIENT):
+                    breaker.record_failure()
+                else:
+                    # Quota and fatal errors still mean the service answered
+                    breaker.record_success()
+            if kind not in (RATE_LIMITED, TRANSIENT) or attempt >= max_attempts:
+                raise
+            delay = retry_after if retry_after is not None else random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            if time.monotonic() - start + delay >= deadline:
+                raise
+            time.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
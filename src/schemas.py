@@ -0,0 +1,111 @@
+# src/schemas.py
+"""
+Response schemas for the pipeline's prompts.
+The same dicts are sent to Gemini as response_schema (constrained JSON decoding) and used
+by validate() to check and normalize what comes back, whichever backend produced it.
+Only the schema keys Gemini accepts are used: type, properties, required, items, enum.
+"""
+
+BULLET = {
+    "type": "object",
+    "properties": {
+        "text": {"type": "string"},
+        "excerpt": {"type": "string"},
+    },
+    "required": ["text"],
+}
+
+RISK = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string"},
+        "severity": {"type": "string", "enum": ["Low", "Medium", "High"]},
+        "excerpt": {"type": "string"},
+        "note": {"type": "string"},
+    },
+    "required": ["type", "severity"],
+}
+
+CHUNK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "bullets": {"type": "array", "items": BULLET},
+        "risks": {"type": "array", "items": RISK},
+    },
+    "required": ["bullets", "risks"],
+}
+
+SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {"summary": {"type": "array", "items": BULLET}},
+    "required": ["summary"],
+}
+
+# Several chunks analyzed in one request: one CHUNK_SCHEMA entry per chunk, keyed by the chunk's number
+CHUNK_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "chunks": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"id": {"type": "integer"}, **CHUNK_SCHEMA["properties"]},
+                "required": ["id"] + CHUNK_SCHEMA["required"],
+            },
+        },
+    },
+    "required": ["chunks"],
+}
+
+RISKS_SCHEMA = {"type": "array", "items": RISK}
+
+class SchemaError(ValueError):
+    """Raised by validate() when a response does not fit its schema."""
+
+def validate(value, schema, path="$"):
+    """
+    Return value checked against schema: unknown object keys are dropped, strings are stripped,
+    enum values are matched case-insensitively and array items that do not fit are skipped.
+    Raises SchemaError if value itself does not fit (wrong type, missing required key).
+    """
+    kind = schema["type"]
+    if kind == "object":
+        if not isinstance(value, dict):
+            raise SchemaError(f"{path}: expected an object")
+        clean = {}
+        for key, sub in schema.get("properties", {}).items():
+            if key in value and value[key] is not None:
+                clean[key] = validate(value[key], sub, f"{path}.{key}")
+        missing = [key for key in schema.get("required", []) if key not in clean]
+        if missing:
+            raise SchemaError(f"{path}: missing {', '.join(missing)}")
+        return clean
+    if kind == "array":
+        if not isinstance(value, list):
+            raise SchemaError(f"{path}: expected an array")
+        items = []
+        for i, item in enumerate(value):
+            try:
+                items.append(validate(item, schema["items"], f"{path}[{i}]"))
+            except SchemaError:
+                continue
+        return items
+    if kind == "string":
+        if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+            raise SchemaError(f"{path}: expected a string")
+        value = str(value).strip()
+        if "enum" in schema:
+            match = next((option for option in schema["enum"] if option.lower() == value.lower()), None)
+            if match is None:
+                raise SchemaError(f"{path}: {value!r} is not one of {', '.join(schema['enum'])}")
+            return match
+        return value
+    if kind == "integer":
+        # Numbers written as strings ("3") are accepted
+        try:
+            if isinstance(value, bool) or float(value) != int(float(value)):
+                raise ValueError
+            return int(float(value))
+        except (TypeError, ValueError, OverflowError):
+            raise SchemaError(f"{path}: expected an integer")
+    raise SchemaError(f"{path}: unsupported schema type {kind}")
@@ -0,0 +1,272 @@
+# src/server.py
+"""
+Local HTTP API for submitting documents for analysis.
+
+    python src/server.py --port 8600
+
+    POST /jobs                 JSON {"text": "...", "use_cache": true}, or the raw bytes of a file with ?filename=terms.pdf
+    GET  /jobs/{id}            status, plan and latest progress
+    GET  /jobs/{id}/result     the analysis (202 while it is still running; ?wait=1 blocks until done)
+    GET  /jobs/{id}/events     newline-delimited JSON stream of plan/progress events, ending with the result
+    GET  /jobs/{id}/text       the document text the job analyzed (202 until it has been extracted)
+    GET  /metrics              per-stage span counts, time and token totals in the Prometheus text format
+
+Jobs run on a fixed pool of worker threads that share the process-wide request budget.
+Submitting a document that is already queued or running returns the existing job.
+"""
+import argparse, asyncio, hashlib, json, os, sys, tempfile, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+import gemini_client, tracing
+from pipeline import analyze_text, extract_document_text, SUPPORTED_EXTENSIONS
+from utils import text_hash
+
+# Documents analyzed at the same time, and how long finished jobs stay available (seconds)
+API_WORKERS = int(os.getenv("TOS_API_WORKERS", "2"))
+JOB_TTL = int(os.getenv("TOS_API_JOB_TTL", "3600"))
+MAX_UPLOAD_MB = int(os.getenv("TOS_API_MAX_UPLOAD_MB", "50"))
+
+class Job:
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.created = time.time()
+        self.finished = None
+        self.plan = None
+        self.progress = None
+        self.result = None
+        self.text = None
+        self.events = []
+        # Replaced on every event; stream readers wait on the one current when they caught up
+        self.updated = asyncio.Event()
+
+    def summary(self):
+        return {"id": self.id, "status": self.status, "created": self.created, "finished": self.finished,
+                "plan": self.plan, "progress": self.progress}
+
+class JobQueue:
+    """
+    In-memory job table plus a bounded worker pool. All job state is changed on the event loop;
+    worker threads hand their progress back through call_soon_threadsafe.
+    """
+
+    def __init__(self, workers=API_WORKERS, job_ttl=JOB_TTL):
+        self.jobs = {}
+        self.in_flight = {}
+        self.job_ttl = job_ttl
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tos-job")
+        self.loop = None
+
+    def _publish(self, job, event):
+        job.events.append(event)
+        if event["event"] == "plan":
+            job.plan = {k: v for k, v in event.items() if k != "event"}
+        elif event["event"] == "progress":
+            job.progress = {"message": event["message"], "fraction": event["fraction"]}
+        job.updated.set()
+        job.updated = asyncio.Event()
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.finished < cutoff]:
+            del self.jobs[job_id]
+
+    def submit(self, load_text, key, use_cache=None):
+        """
+        Queue an analysis of load_text(progress_callback) (called on a worker thread) unless a job
+        for the same document key is already queued or running. Returns (job, created).
+        """
+        self.loop = asyncio.get_running_loop()
+        self._prune()
+        existing = self.in_flight.get(key)
+        if existing is not None:
+            return existing, False
+        job = Job(key)
+        self.jobs[job.id] = job
+        self.in_flight[key] = job
+        self.loop.create_task(self._run(job, load_text, use_cache))
+        return job, True
+
+    async def _run(self, job, load_text, use_cache):
+        def emit(event):
+            self.loop.call_soon_threadsafe(self._publish, job, event)
+
+        def set_running():
+            job.status = "running"
+
+        def set_text(text):
+            job.text = text
+
+        def report_page(done, total, stage):
+            label = "Running OCR on" if stage == "ocr" else "Reading"
+            emit({"event": "progress", "message": f"{label} page {done} of {total}...", "fraction": None})
+
+        def work():
+            self.loop.call_soon_threadsafe(set_running)
+            # Extraction and analysis share one trace, exported when the job ends
+            with tracing.start_trace("analysis", job=job.id):
+                text = load_text(report_page)
+                self.loop.call_soon_threadsafe(set_text, text)
+                if not text or len(text.strip()) < 10:
+                    return {"error": "NO_TEXT", "message": "No valid text found in the document."}
+                return analyze_text(text, use_cache=use_cache,
+                                    on_plan=lambda plan: emit(dict(plan, event="plan")),
+                                    on_progress=lambda message, fraction=None: emit({"event": "progress", "message": message, "fraction": fraction}))
+
+        try:
+            result = await self.loop.run_in_executor(self.executor, work)
+        except Exception as e:
+            result = {"error": str(e)}
+        job.result = result
+        job.status = "failed" if isinstance(result, dict) and "error" in result else "done"
+        job.finished = time.time()
+        self.in_flight.pop(job.key, None)
+        self._publish(job, {"event": "result", "status": job.status, "result": result})
+
+    async def wait(self, job):
+        while job.finished is None:
+            await job.updated.wait()
+
+    async def stream(self, job):
+        """Yield every event of job, past and future, until its result has been sent."""
+        cursor = 0
+        while True:
+            updated = job.updated
+            while cursor < len(job.events):
+                yield job.events[cursor]
+                cursor += 1
+            if job.finished is not None:
+                return
+            await updated.wait()
+
+queue = JobQueue()
+
+def _job_or_404(request):
+    job = queue.jobs.get(request.path_params["job_id"])
+    if job is None:
+        return None, JSONResponse({"error": "NOT_FOUND", "message": "Unknown or expired job id."}, status_code=404)
+    return job, None
+
+async def _read_body(request, max_bytes):
+    """The request body, or None as soon as it is known to be longer than max_bytes."""
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > max_bytes:
+        return None
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def submit_job(request):
+    content_type = request.headers.get("content-type", "")
+    # Oversized uploads are turned away before they are buffered
+    body = await _read_body(request, MAX_UPLOAD_MB * 1024 * 1024)
+    if body is None:
+        return JSONResponse({"error": "TOO_LARGE", "message": f"Uploads are limited to {MAX_UPLOAD_MB} MB."}, status_code=413)
+    if content_type.startswith("application/json"):
+        try:
+            payload = json.loads(body)
+            text = payload.get("text", "")
+            # Asking for the cache means the server's default, which TOS_CACHE_DISABLED can turn off
+            use_cache = None if payload.get("use_cache", True) else False
+        except (ValueError, AttributeError):
+            return JSONResponse({"error": "BAD_REQUEST", "message": 'Expected a JSON object like {"text": "..."}.'}, status_code=400)
+        if not isinstance(text, str) or not text.strip():
+            return JSONResponse({"error": "BAD_REQUEST", "message": "The text field is empty."}, status_code=400)
+        key = text_hash(text)
+        load_text = lambda progress_callback: text
+    else:
+        ext = os.path.splitext(request.query_params.get("filename", ""))[1].lower()
+        if ext not in SUPPORTED_EXTENSIONS:
+            return JSONResponse({"error": "BAD_REQUEST",
+                                 "message": f"Pass ?filename= with one of {', '.join(SUPPORTED_EXTENSIONS)}."}, status_code=400)
+        # Identical uploads are the same document; the extracted text is only known once a worker runs
+        key = f"file:{hashlib.sha256(body).hexdigest()}"
+        use_cache = False if request.query_params.get("use_cache", "1").lower() in ("0", "false", "no") else None
+
+        def load_text(progress_callback):
+            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
+            try:
+                tmp.write(body)
+                tmp.close()
+                return extract_document_text(tmp.name, progress_callback=progress_callback)
+            finally:
+                os.unlink(tmp.name)
+
+    job, created = queue.submit(load_text, key, use_cache)
+    return JSONResponse(job.summary(), status_code=202 if created else 200)
+
+async def job_status(request):
+    job, error = _job_or_404(request)
+    return error or JSONResponse(job.summary())
+
+async def job_result(request):
+    job, error = _job_or_404(request)
+    if error:
+        return error
+    if job.finished is None and request.query_params.get("wait") in ("1", "true", "yes"):
+        await queue.wait(job)
+    if job.finished is None:
+        return JSONResponse(job.summary(), status_code=202)
+    return JSONResponse(job.result)
+
+async def job_text(request):
+    job, error = _job_or_404(request)
+    if error:
+        return error
+    if job.text is None:
+        return JSONResponse(job.summary(), status_code=202)
+    return PlainTextResponse(job.text)
+
+async def job_events(request):
+    job, error = _job_or_404(request)
+    if error:
+        return error
+
+    async def lines():
+        async for event in queue.stream(job):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+async def metrics(request):
+    return PlainTextResponse(tracing.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+async def health(request):
+    return JSONResponse({"status": "ok", "jobs": len(queue.jobs), "in_flight": len(queue.in_flight)})
+
+app = Starlette(routes=[
+    Route("/health", health),
+    Route("/metrics", metrics),
+    Route("/jobs", submit_job, methods=["POST"]),
+    Route("/jobs/{job_id}", job_status),
+    Route("/jobs/{job_id}/result", job_result),
+    Route("/jobs/{job_id}/events", job_events),
+    Route("/jobs/{job_id}/text", job_text),
+])
+
+def main(argv=None):
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Serve the ToS Decoder analysis API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("Please set GEMINI_API_KEY in the environment or a .env file.", file=sys.stderr)
+        return 2
+    gemini_client.configure(api_key)
+    uvicorn.run(app, host=args.host, port=args.port)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# src/tracing.py
+"""
+Lightweight per-stage tracing for the analysis pipeline.
+
+Code wraps a stage in span(name, **attrs); spans land in the trace active in the current
+context (start_trace), which analyze_text attaches to its result. If TOS_TRACE_PATH is set,
+finished traces are also appended to that JSON-lines file, which is rotated once it reaches
+TOS_TRACE_MAX_MB. Per-stage totals are kept for prometheus_text().
+Without an active trace, span() only feeds the totals.
+"""
+import contextvars, json, os, threading, time, uuid
+from contextlib import contextmanager
+
+# Traces hold document paths, so they are only written to disk when asked for ("off" or empty = don't)
+TRACE_PATH = os.getenv("TOS_TRACE_PATH", "")
+# The trace file is moved to <path>.1 (replacing the previous one) once it grows past this size
+TRACE_MAX_MB = float(os.getenv("TOS_TRACE_MAX_MB", "50"))
+
+_current = contextvars.ContextVar("tos_trace", default=None)
+_lock = threading.Lock()
+# stage -> [spans, seconds]; (stage, attribute) -> sum, for the numeric attributes in COUNTED_ATTRS
+_stage_totals = {}
+_attr_totals = {}
+COUNTED_ATTRS = ("prompt_tokens", "response_tokens", "cached_tokens", "retries")
+
+class Trace:
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self):
+        """Make this the current trace for the enclosed block (steps of one run can be spread out)."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def finish(self):
+        """Stop the clock and export the trace."""
+        self.duration = time.perf_counter() - self._t0
+        export(self)
+
+    def add(self, name, start, seconds, attrs):
+        with self._lock:
+            self.spans.append(dict(attrs, name=name, start_ms=round((start - self._t0) * 1000, 1),
+                                   duration_ms=round(seconds * 1000, 1)))
+
+    def stages(self):
+        """{stage: {'count', 'total_ms', 'max_ms'}} over the spans recorded so far."""
+        stages = {}
+        with self._lock:
+            for s in self.spans:
+                stage = stages.setdefault(s["name"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+                stage["count"] += 1
+                stage["total_ms"] = round(stage["total_ms"] + s["duration_ms"], 1)
+                stage["max_ms"] = max(stage["max_ms"], s["duration_ms"])
+        return stages
+
+    def to_dict(self):
+        duration = self.duration if self.duration is not None else time.perf_counter() - self._t0
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {"trace_id": self.id, "name": self.name, **self.attrs, "started": self.started,
+                "duration_ms": round(duration * 1000, 1), "stages": self.stages(), "spans": spans}
+
+def _count(name, seconds, attrs):
+    with _lock:
+        totals = _stage_totals.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+        for attr in COUNTED_ATTRS:
+            if isinstance(attrs.get(attr), (int, float)):
+                _attr_totals[(name, attr)] = _attr_totals.get((name, attr), 0) + attrs[attr]
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time the enclosed block as one span. Yields the attribute dict, so the block can add
+    results (token counts, sizes...) before the span is recorded. Exceptions are recorded too.
+    """
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        record(name, time.perf_counter() - start, start=start, **attrs)
+
+def record(name, seconds, start=None, wall_start=None, **attrs):
+    """
+    Add an already-timed span. start is a time.perf_counter() reading; a span measured in a worker
+    process passes its time.time() start as wall_start instead, since perf_counter readings are
+    not comparable across processes.
+    """
+    _count(name, seconds, attrs)
+    trace = _current.get()
+    if trace is not None:
+        if start is None:
+            start = time.perf_counter() - (time.time() - wall_start if wall_start is not None else seconds)
+        trace.add(name, start, seconds, attrs)
+
+def current_trace():
+    return _current.get()
+
+@contextmanager
+def start_trace(name, **attrs):
+    """
+    Make a new trace current for the enclosed block and export it at the end.
+    Nested calls join the trace that is already active instead of starting another one.
+    """
+    active = _current.get()
+    if active is not None:
+        yield active
+        return
+    trace = Trace(name, **attrs)
+    try:
+        with trace.activate():
+            yield trace
+    finally:
+        trace.finish()
+
+def in_context(fn):
+    """fn bound to the caller's context, so spans from pool threads join the caller's trace."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+def export(trace):
+    if not TRACE_PATH or TRACE_PATH.lower() == "off":
+        return
+    try:
+        os.makedirs(os.path.dirname(TRACE_PATH) or ".", exist_ok=True)
+        line = json.dumps(trace.to_dict())
+        with _lock:
+            if os.path.exists(TRACE_PATH) and os.path.getsize(TRACE_PATH) + len(line) > TRACE_MAX_MB * 1024 * 1024:
+                os.replace(TRACE_PATH, TRACE_PATH + ".1")
+            with open(TRACE_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        print(f"Trace export error: {e}")
+
+def prometheus_text():
+    """Per-stage totals since process start, in the Prometheus text exposition format."""
+    with _lock:
+        stages = {name: tuple(totals) for name, totals in _stage_totals.items()}
+        attrs = dict(_attr_totals)
+    lines = ["# HELP tos_stage_spans_total Spans recorded per pipeline stage.",
+             "# TYPE tos_stage_spans_total counter"]
+    lines += [f'tos_stage_spans_total{{stage="{name}"}} {count}' for name, (count, _) in sorted(stages.items())]
+    lines += ["# HELP tos_stage_seconds_total Time spent per pipeline stage.",
+              "# TYPE tos_stage_seconds_total counter"]
+    lines += [f'tos_stage_seconds_total{{stage="{name}"}} {seconds:.6f}' for name, (_, seconds) in sorted(stages.items())]
+    for attr in COUNTED_ATTRS:
+        values = sorted((name, v) for (name, a), v in attrs.items() if a == attr)
+        if values:
+            lines += [f"# HELP tos_stage_{attr}_total Sum of {attr.replace('_', ' ')} per pipeline stage.",
+                      f"# TYPE tos_stage_{attr}_total counter"]
+            lines += [f'tos_stage_{attr}_total{{stage="{name}"}} {v}' for name, v in values]
+    return "\n".join(lines) + "\n"
@@ -1,79 +1,365 @@
 # src/utils.py
 import pdfplumber
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
 from PIL import Image
-import io, re, hashlib
+import io, os, re, hashlib, multiprocessing, tempfile, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import tracing
 
-def extract_text_from_pdf(path, ocr_threshold_chars=100):
+PAGE_BREAK = "\f"
+# Smallest page range one text-extraction task covers
+TEXT_RANGE_MIN_PAGES = 8
+# OCR priority of a page, from _extract_page_range
+OCR_SKIP, OCR_NEEDED, OCR_LIKELY_SCAN = 0, 1, 2
+
+OCR_CONFIG = '--psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,;:!?()[]{}"\' '
+
+def _extract_page_range(path, first_page, last_page, ocr_threshold_chars=100):
     """
-    1) Try pdfplumber for selectable text.
-    2) If result is very short (likely scanned), fallback to OCR via pdf2image + pytesseract.
+    Worker: selectable text of pages first_page..last_page (1-based, inclusive) via pdfplumber,
+    plus each page's OCR priority. The file is opened once for the whole range, since every
+    open walks the page tree again. Every page with less than ocr_threshold_chars of text needs
+    OCR, since scans can be vector drawings or nested forms rather than image objects; pages
+    with images rank first (likely scans), and only pages that draw nothing at all are skipped.
+    """
+    pages = []
+    with pdfplumber.open(path, pages=range(first_page, last_page + 1)) as pdf:
+        for page in pdf.pages:
+            page_text = (page.extract_text() if page.chars else "") or ""
+            if len(page_text.strip()) >= ocr_threshold_chars or not any(page.objects.values()):
+                priority = OCR_SKIP
+            else:
+                priority = OCR_LIKELY_SCAN if page.images else OCR_NEEDED
+            pages.append((page_text, priority))
+            # Drop the page's parsed objects before moving on
+            page.close()
+    return pages
+
+def _preprocess_for_ocr(img):
+    """Grayscale and upscale small pages; the source image is closed as soon as it is converted."""
+    # Enhanced preprocessing for better OCR
+    gray = img.convert("L")
+    img.close()
+    # Resize if too small
+    if gray.width < 1000:
+        resized = gray.resize((gray.width * 2, gray.height * 2), Image.Resampling.LANCZOS)
+        gray.close()
+        gray = resized
+    return gray
+
+def _ocr_page_window(path, first_page, last_page, dpi=200):
+    """
+    Worker: rasterize pages first_page..last_page (1-based, inclusive) to a temp dir and
+    OCR them one at a time, so at most one decoded page is held in memory.
+    Returns ((start, seconds) of rasterizing, [(text, start, seconds) per page]); starts are
+    time.time() readings, so the parent can place them on its own timeline.
+    """
+    pages = []
+    with tempfile.TemporaryDirectory(prefix="tos-ocr-") as tmp_dir:
+        raster_start, t0 = time.time(), time.perf_counter()
+        image_paths = convert_from_path(path, dpi=dpi, first_page=first_page, last_page=last_page,
+                                        output_folder=tmp_dir, paths_only=True, fmt="png")
+        raster = (raster_start, time.perf_counter() - t0)
+        for image_path in image_paths:
+            start, t0 = time.time(), time.perf_counter()
+            with Image.open(image_path) as img:
+                gray = _preprocess_for_ocr(img)
+            try:
+                text = pytesseract.image_to_string(gray, config=OCR_CONFIG)
+            finally:
+                gray.close()
+            os.unlink(image_path)
+            pages.append((text, start, time.perf_counter() - t0))
+    return raster, pages
+
+def _pool_context():
+    """
+    Start workers from a fresh process instead of forking this one: the app and the API server
+    are multi-threaded and hold an open gRPC channel, neither of which survives a fork safely.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def _map_pages(func, path, tasks, max_workers=None, progress_callback=None, stage="", weights=None):
+    """
+    Run func(path, *task) for every task on a process pool and return results in task order.
+    progress_callback(done, total, stage) is called from the calling thread as tasks finish;
+    weights gives the number of pages each task covers (default 1).
+    """
+    weights = weights or [1] * len(tasks)
+    total = sum(weights)
+    results = [None] * len(tasks)
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(tasks)))
+    if workers == 1:
+        done = 0
+        for i, task in enumerate(tasks):
+            results[i] = func(path, *task)
+            done += weights[i]
+            if progress_callback:
+                progress_callback(done, total, stage)
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as executor:
+        futures = {executor.submit(func, path, *task): i for i, task in enumerate(tasks)}
+        done = 0
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            done += weights[i]
+            if progress_callback:
+                progress_callback(done, total, stage)
+    return results
+
+def _page_windows(page_numbers, window):
+    """Group sorted 1-based page numbers into runs of consecutive pages, at most window long."""
+    windows = []
+    for n in page_numbers:
+        if windows and n == windows[-1][1] + 1 and n - windows[-1][0] < window:
+            windows[-1][1] = n
+        else:
+            windows.append([n, n])
+    return [tuple(w) for w in windows]
+
+def extract_text_from_pdf(path, ocr_threshold_chars=100, max_workers=None, progress_callback=None,
+                          ocr_max_pages=None, ocr_window_pages=2):
+    """
+    1) Try pdfplumber for selectable text on every page.
+    2) Pages with fewer than ocr_threshold_chars of text fall back to OCR via pdf2image +
+       pytesseract; the rest keep their pdfplumber text.
+    Pages are processed in parallel on a process pool of max_workers (default: CPU count).
+    OCR rasterizes up to ocr_window_pages consecutive pages per task, so peak memory depends on
+    the worker count rather than the page count; at most ocr_max_pages pages are OCR'd,
+    pages with images first.
     """
-    text = ""
     try:
-        with pdfplumber.open(path) as pdf:
-            for p in pdf.pages:
-                page_text = p.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+        with tracing.span("pdf_text") as info:
+            with pdfplumber.open(path) as pdf:
+                page_count = len(pdf.pages)
+            # A few contiguous ranges per worker: enough to balance the load, few enough file opens
+            workers = max(1, max_workers or os.cpu_count() or 1)
+            span = max(TEXT_RANGE_MIN_PAGES, -(-page_count // (workers * 4)))
+            tasks = [(first, min(first + span - 1, page_count), ocr_threshold_chars)
+                     for first in range(1, page_count + 1, span)]
+            weights = [last - first + 1 for first, last, _ in tasks]
+            ranges = _map_pages(_extract_page_range, path, tasks, max_workers, progress_callback, "text", weights)
+            pages = [page for pages_in_range in ranges for page in pages_in_range]
+            info["pages"] = page_count
+        page_texts = [t for t, _ in pages]
+        # Likely scans first, so they are the ones kept if ocr_max_pages cuts the list
+        ocr_pages = sorted((i + 1 for i, (_, priority) in enumerate(pages) if priority != OCR_SKIP),
+                           key=lambda n: -pages[n - 1][1])
     except Exception as e:
         print(f"PDF extraction error: {e}")
-        text = ""
+        # Without a page structure, OCR the whole document
+        try:
+            page_count = pdfinfo_from_path(path)["Pages"]
+        except Exception as e:
+            print(f"OCR extraction error: {e}")
+            return ""
+        page_texts = [""] * page_count
+        ocr_pages = list(range(1, page_count + 1))
 
-    # If no useful text, use OCR with better preprocessing
-    if len(text.strip()) < ocr_threshold_chars:
+    if ocr_pages:
+        if ocr_max_pages and len(ocr_pages) > ocr_max_pages:
+            print(f"OCR limited to {ocr_max_pages} of {len(ocr_pages)} scanned pages")
+            ocr_pages = ocr_pages[:ocr_max_pages]
+        ocr_pages.sort()
         try:
-            images = convert_from_path(path, dpi=200)  # Higher DPI for better OCR
-            for img in images:
-                # Enhanced preprocessing for better OCR
-                gray = img.convert("L")
-                # Resize if too small
-                if gray.width < 1000:
-                    gray = gray.resize((gray.width * 2, gray.height * 2), Image.Resampling.LANCZOS)
-                # Use better OCR configuration
-                ocr_text = pytesseract.image_to_string(gray, config='--psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,;:!?()[]{}"\' ')
-                text += ocr_text + "\n"
+            tasks = _page_windows(ocr_pages, max(1, ocr_window_pages))
+            weights = [last - first + 1 for first, last in tasks]
+            with tracing.span("ocr", pages=len(ocr_pages)):
+                windows = _map_pages(_ocr_page_window, path, tasks, max_workers, progress_callback, "ocr", weights)
+            for (first, last), ((raster_start, raster_seconds), window) in zip(tasks, windows):
+                tracing.record("ocr_rasterize", raster_seconds, wall_start=raster_start, pages=last - first + 1)
+                for offset, (ocr_text, start, seconds) in enumerate(window):
+                    tracing.record("ocr_page", seconds, wall_start=start, page=first + offset, chars=len(ocr_text))
+                    # Keep whichever is longer, e.g. a short caption page vs. its scanned body
+                    if len(ocr_text.strip()) > len(page_texts[first - 1 + offset].strip()):
+                        page_texts[first - 1 + offset] = ocr_text
         except Exception as e:
             print(f"OCR extraction error: {e}")
-    
-    return text
+
+    # Pages are separated by form feeds so sanitize_text can spot running headers/footers
+    return PAGE_BREAK.join(t.strip("\n") for t in page_texts if t) + "\n"
 
 def extract_text_from_image_bytes(image_bytes):
     img = Image.open(io.BytesIO(image_bytes))
     gray = img.convert("L")
     return pytesseract.image_to_string(gray)
 
+def _boilerplate_key(line):
+    """Normalize a line so running headers/footers match across pages (page numbers, dates, case)."""
+    return re.sub(r"\d+", "#", " ".join(line.lower().split()))
+
+def find_boilerplate_lines(pages, edge_lines=3, min_ratio=0.5, min_pages=3, max_len=150):
+    """
+    Keys of lines that recur near the top or bottom of at least min_ratio of the pages
+    (running headers, footers, confidentiality banners, URLs).
+    """
+    if len(pages) < min_pages:
+        return set()
+    counts = {}
+    for page in pages:
+        lines = [l for l in page.split("\n") if l.strip()]
+        edges = lines[:edge_lines] + lines[-edge_lines:]
+        for key in {_boilerplate_key(l) for l in edges if len(l.strip()) <= max_len}:
+            counts[key] = counts.get(key, 0) + 1
+    threshold = max(min_pages, min_ratio * len(pages))
+    return {key for key, count in counts.items() if count >= threshold and key.strip("# ")}
+
 def sanitize_text(text):
-    """Remove repeated headers/footers (simple heuristics), excessive whitespace."""
+    """
+    Remove repeated headers/footers and page numbers, rejoin words hyphenated across
+    line breaks, and normalize whitespace. Running headers/footers are detected across
+    the form-feed separated pages produced by extract_text_from_pdf.
+    """
+    pages = text.split(PAGE_BREAK)
+    boilerplate = find_boilerplate_lines(pages)
+    if boilerplate:
+        pages = ["\n".join(l for l in page.split("\n") if _boilerplate_key(l) not in boilerplate) for page in pages]
+    text = "\n\n".join(pages)
     # Remove page numbers like "Page 1 of 5"
     text = re.sub(r"\bPage\s+\d+\b(?:\s+of\s+\d+)?", "", text, flags=re.IGNORECASE)
+    # Rejoin words split across lines: "agree-\nment" -> "agreement" when the document uses
+    # "agreement" elsewhere, otherwise keep the hyphen ("third-\nparty" -> "third-party")
+    words = set(re.findall(r"\w+", text.lower()))
+    text = re.sub(r"(\w+)-[ \t]*\n[ \t]*([a-z]\w*)",
+                  lambda m: m[1] + m[2] if (m[1] + m[2]).lower() in words else f"{m[1]}-{m[2]}", text)
+    # Normalize whitespace: odd spaces, zero-width characters, runs of spaces, trailing spaces
+    text = text.replace("\u00a0", " ").replace("\u200b", "").replace("\ufeff", "")
+    text = re.sub(r"[ \t\r\f\v]+", " ", text)
+    text = re.sub(r" *\n *", "\n", text)
     # Remove multiple newlines
     text = re.sub(r"\n{2,}", "\n\n", text)
     return text.strip()
 
+# Rough average for English prose with Gemini's tokenizer
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    """Local token estimate (no API call), rounded up."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
 def text_hash(text):
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
-import re
+SENTENCE_BREAK_RE = re.compile(r'(?<=[\.\?\!])\s+')
+CLAUSE_BREAKS = ("; ", ": ", ", ")
 
-def chunk_text_sentence_aware(text, max_chars=3000, overlap_chars=200):
-    # split on sentence boundaries roughly
-    sentences = re.split(r'(?<=[\.\?\!])\s+', text)
-    chunks = []
-    current = ""
-    for s in sentences:
-        if len(current) + len(s) + 1 <= max_chars:
-            current += ("" if current=="" else " ") + s
+def _sentence_spans(text):
+    """(start, end) offsets of sentences, split after . ? ! followed by whitespace."""
+    spans = []
+    start = 0
+    for m in SENTENCE_BREAK_RE.finditer(text):
+        if m.start() > start:
+            spans.append((start, m.start()))
+        start = m.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+def _split_long_span(text, start, end, limit):
+    """Split [start, end) into pieces of at most limit chars, preferring clause, then word boundaries."""
+    pieces = []
+    while end - start > limit:
+        window_end = start + limit
+        cut = -1
+        for sep in CLAUSE_BREAKS:
+            cut = max(cut, text.rfind(sep, start + limit // 2, window_end) + len(sep) - 1)
+        if cut <= start:
+            cut = max(text.rfind(" ", start + 1, window_end), text.rfind("\n", start + 1, window_end))
+        if cut <= start:
+            cut = window_end
+        pieces.append((start, cut))
+        start = cut
+        # The separator whitespace belongs to neither piece
+        while start < end and text[start].isspace():
+            start += 1
+    if start < end:
+        pieces.append((start, end))
+    return pieces
+
+def _bounded_sentence_spans(text, limit):
+    spans = []
+    for start, end in _sentence_spans(text):
+        if end - start > limit:
+            spans.extend(_split_long_span(text, start, end, limit))
         else:
-            if current:
-                chunks.append(current)
-            # start new chunk with overlap
-            if overlap_chars > 0 and chunks:
-                overlap = chunks[-1][-overlap_chars:]
-                current = (overlap + " " + s).strip()
-            else:
-                current = s
-    if current:
-        chunks.append(current)
-    return chunks
+            spans.append((start, end))
+    return spans
+
+def _with_overlap(text, bodies, overlap_chars):
+    """
+    Extend each body span (after the first) backwards by up to overlap_chars, snapped to a
+    word start, without reaching into the previous body's own overlap.
+    """
+    spans = []
+    for i, (start, end) in enumerate(bodies):
+        if overlap_chars > 0 and i > 0:
+            prev_start = bodies[i - 1][0]
+            ov = max(prev_start, start - overlap_chars)
+            if ov > prev_start and not text[ov - 1].isspace():
+                space = text.find(" ", ov, start)
+                ov = space + 1 if space != -1 else start
+            start = ov
+        spans.append((start, end))
+    return spans
+
+def chunk_spans_sentence_aware(text, max_chars=3000, overlap_chars=200):
+    """
+    (start, end) offsets of sentence-aware chunks of at most max_chars, overlap included.
+    Runs in linear time; sentences longer than a chunk are split on clause or word boundaries.
+    """
+    overlap_chars = max(0, min(overlap_chars, max_chars // 2))
+    body_chars = max(1, max_chars - overlap_chars)
+    bodies = []
+    current = None
+    for start, end in _bounded_sentence_spans(text, body_chars):
+        if current is not None and end - current[0] > body_chars:
+            bodies.append(current)
+            current = None
+        current = (start, end) if current is None else (current[0], end)
+    if current is not None:
+        bodies.append(current)
+    return _with_overlap(text, bodies, overlap_chars)
+
+def chunk_text_sentence_aware(text, max_chars=3000, overlap_chars=200):
+    return [text[start:end] for start, end in chunk_spans_sentence_aware(text, max_chars, overlap_chars)]
+
+def _boundary_score(sentence):
+    """Stable pseudo-random value in [0, 1) derived only from the sentence content."""
+    digest = hashlib.sha1(" ".join(sentence.lower().split()).encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) / 0x100000000
+
+def chunk_spans_content_defined(text, max_chars=3000, overlap_chars=200, min_chars=None, target_chars=None):
+    """
+    Content-defined variant of chunk_spans_sentence_aware.
+    A chunk ends after a sentence whose content hash falls under a length-weighted
+    threshold, so boundaries depend on local text only and stay put when
+    paragraphs are inserted or removed elsewhere in the document.
+    """
+    overlap_chars = max(0, min(overlap_chars, max_chars // 2))
+    # Leave room for the overlap so finished chunks still fit in max_chars
+    body_chars = max(1, max_chars - overlap_chars)
+    min_chars = body_chars // 2 if min_chars is None else min_chars
+    target_chars = body_chars // 3 if target_chars is None else target_chars
+    bodies = []
+    current = None
+    for start, end in _bounded_sentence_spans(text, body_chars):
+        # Forced cut: the next sentence would overflow the chunk
+        if current is not None and end - current[0] > body_chars:
+            bodies.append(current)
+            current = None
+        current = (start, end) if current is None else (current[0], end)
+        # Content-defined cut: expected chunk length is roughly min_chars + target_chars
+        if current[1] - current[0] >= min_chars and _boundary_score(text[start:end]) < (end - start) / target_chars:
+            bodies.append(current)
+            current = None
+    if current is not None:
+        bodies.append(current)
+    return _with_overlap(text, bodies, overlap_chars)
+
+def chunk_text_content_defined(text, max_chars=3000, overlap_chars=200, min_chars=None, target_chars=None):
+    spans = chunk_spans_content_defined(text, max_chars, overlap_chars, min_chars, target_chars)
+    return [text[start:end] for start, end in spans]
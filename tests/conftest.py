@@ -0,0 +1,48 @@
+import os, random, sys, tempfile
+from types import SimpleNamespace
+
+# Keep test runs away from the user's cache, budget and trace files, before the pipeline reads its settings
+_tmp = tempfile.mkdtemp(prefix="tos-tests-")
+os.environ.setdefault("TOS_CACHE_PATH", os.path.join(_tmp, "cache.sqlite3"))
+os.environ.setdefault("TOS_BUDGET_PATH", os.path.join(_tmp, "budget.sqlite3"))
+os.environ["TOS_TRACE_PATH"] = "off"
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import pytest
+import llm, pipeline, retry
+from cache import AnalysisCache
+from ratelimit import RequestBudget
+from retry import CircuitBreaker
+
+WORDS = ("the user agrees that company may share personal data with partners terminate account "
+         "service liability arbitration fees renewal license content notice refund").split()
+
+def make_text(n_chars, seed=0):
+    """ToS-like prose with no repeated sections, so every chunk is analyzed."""
+    rng = random.Random(seed)
+    sentences, size = [], 0
+    while size < n_chars:
+        sentence = f"{len(sentences)}. " + " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "."
+        sentences.append(sentence)
+        size += len(sentence) + 1
+    return " ".join(sentences)
+
+@pytest.fixture
+def fresh_pipeline(tmp_path, monkeypatch):
+    """
+    Fresh request budget, circuit breaker and cache for one test, no backoff sleeps, and an
+    offline FakeBackend. Returns a function that swaps in another backend and returns it.
+    """
+    monkeypatch.setattr(pipeline, "_request_budget", RequestBudget(str(tmp_path / "budget.sqlite3"), daily_limit=1000,
+                                                                   requests_per_minute=100000))
+    monkeypatch.setattr(pipeline, "_circuit_breaker", CircuitBreaker(failure_threshold=5, reset_timeout=30))
+    monkeypatch.setattr(pipeline, "_analysis_cache", AnalysisCache(str(tmp_path / "cache.sqlite3")))
+    monkeypatch.setattr(retry, "random", SimpleNamespace(uniform=lambda a, b: 0.0))
+    previous = llm.set_backend(llm.FakeBackend())
+
+    def use_backend(backend):
+        llm.set_backend(backend)
+        return backend
+    yield use_backend
+    llm.set_backend(previous)
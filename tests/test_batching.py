@@ -0,0 +1,70 @@
+import json
+from google.api_core import exceptions as api_exceptions
+import llm, pipeline
+from conftest import make_text
+from pipeline import split_batch_result
+
+BATCH = [(1, "first"), (2, "second"), (3, "third")]
+
+def test_split_batch_result_keys_entries_by_chunk_number():
+    res = {"chunks": [{"id": 3, "bullets": [], "risks": []}, {"id": 1, "bullets": [{"text": "a"}], "risks": []}]}
+    summaries = split_batch_result(BATCH, res)
+    assert summaries[1] == {"bullets": [{"text": "a"}], "risks": []}
+    assert summaries[3] == {"bullets": [], "risks": []}
+    assert summaries[2]["invalid"] == "no entry for chunk 2"
+
+def test_split_batch_result_lone_chunk_takes_the_only_entry():
+    res = {"chunks": [{"id": 7, "bullets": [], "risks": []}]}
+    assert split_batch_result([(2, "x")], res) == {2: {"bullets": [], "risks": []}}
+
+def test_split_batch_result_passes_errors_and_unreadable_output_to_every_chunk():
+    error = {"error": "403 API key not valid"}
+    assert split_batch_result(BATCH, error) == {1: error, 2: error, 3: error}
+    raw = {"raw": '{"chunks": [', "invalid": "cut off"}
+    assert split_batch_result(BATCH, raw) == {1: raw, 2: raw, 3: raw}
+
+class DroppingBackend(llm.FakeBackend):
+    """Leaves every seventh chunk out of its batched answers."""
+
+    def respond(self, prompt):
+        answer = super().respond(prompt)
+        if "Text chunk" not in prompt:
+            return answer
+        data = json.loads(answer)
+        data["chunks"] = [entry for entry in data["chunks"] if entry["id"] % 7]
+        return json.dumps(data)
+
+class DeniedBackend(llm.FakeBackend):
+    """Rejects every request, as Gemini does with a bad API key; counts the chunk prompts."""
+
+    def generate(self, prompt, model_name, **kwargs):
+        with self._lock:
+            self.calls += "Text chunk" in prompt
+        raise api_exceptions.PermissionDenied("403 API key not valid. Please pass a valid API key.")
+
+def test_batches_cost_far_fewer_requests_than_chunks(fresh_pipeline):
+    backend = fresh_pipeline(llm.FakeBackend())
+    plans = []
+    result = pipeline.analyze_text(make_text(300000), use_cache=False, on_plan=plans.append)
+    assert plans[0]["chunks"] >= 10
+    assert backend.calls == plans[0]["planned_calls"] < plans[0]["chunks"]
+    assert not any("raw" in s or "error" in s for s in result["chunks"])
+
+def test_chunks_missing_from_a_batch_are_resent_alone(fresh_pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "CHUNK_BATCH_SIZE", 4)
+    backend = fresh_pipeline(DroppingBackend())
+    result = pipeline.analyze_text(make_text(300000, seed=1), use_cache=False)
+    missing = [k + 1 for k, s in enumerate(result["chunks"]) if "raw" in s]
+    # Retried until alone, where the chunk still has no entry and keeps its unreadable result
+    assert missing and all(i % 7 == 0 for i in missing)
+    assert all("bullets" in s for k, s in enumerate(result["chunks"]) if (k + 1) % 7)
+
+def test_api_errors_are_not_split_and_resent(fresh_pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "CHUNK_BATCH_SIZE", 4)
+    text = make_text(300000, seed=2)
+    backend = fresh_pipeline(DeniedBackend())
+    plans = []
+    result = pipeline.analyze_text(text, use_cache=False, on_plan=plans.append)
+    assert all("403" in s["error"] for s in result["chunks"])
+    # One request per batch of 4, none resent
+    assert backend.calls == -(-plans[0]["chunks"] // 4)
@@ -0,0 +1,33 @@
+import llm, pipeline
+from conftest import make_text
+from ratelimit import RequestBudget
+
+def set_budget(monkeypatch, tmp_path, daily_limit):
+    budget = RequestBudget(str(tmp_path / "limited.sqlite3"), daily_limit=daily_limit, requests_per_minute=100000)
+    monkeypatch.setattr(pipeline, "_request_budget", budget)
+    return budget
+
+def test_retries_count_against_the_budget(fresh_pipeline, monkeypatch, tmp_path):
+    budget = set_budget(monkeypatch, tmp_path, 50)
+    # Every other call fails with a 503 and is retried
+    backend = fresh_pipeline(llm.FakeBackend(error_rate=0.5, seed=3))
+    pipeline.analyze_text(make_text(100000), use_cache=False)
+    assert backend.calls > 0
+    assert budget.used_today() == backend.calls
+
+def test_open_circuit_does_not_use_up_the_budget(fresh_pipeline, monkeypatch, tmp_path):
+    budget = set_budget(monkeypatch, tmp_path, 50)
+    backend = fresh_pipeline(llm.FakeBackend(error_rate=1.0))
+    result = pipeline.analyze_text(make_text(300000), use_cache=False)
+    # The breaker opens after 5 failed calls (give or take the calls already in flight);
+    # the fast failures after that are not requests
+    assert backend.calls < 10
+    assert budget.used_today() == backend.calls
+    assert result.get("error") != "API_QUOTA_EXCEEDED"
+
+def test_budget_running_out_between_retries_stops_the_prompt(fresh_pipeline, monkeypatch, tmp_path):
+    budget = set_budget(monkeypatch, tmp_path, 2)
+    backend = fresh_pipeline(llm.FakeBackend(error_rate=1.0))
+    result = pipeline.run_gemini_prompt("Text chunk 1:\nx")
+    assert result["error"] == "API_QUOTA_EXCEEDED"
+    assert backend.calls == budget.used_today() == 2
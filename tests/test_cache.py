@@ -0,0 +1,35 @@
+import time
+import pytest
+import llm, pipeline
+from cache import AnalysisCache
+from conftest import make_text
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_analyze_text_follows_the_cache_setting_by_default(fresh_pipeline, monkeypatch, enabled):
+    monkeypatch.setattr(pipeline, "CACHE_ENABLED", enabled)
+    text = make_text(20000, seed=5)
+    fresh_pipeline(llm.FakeBackend())
+    pipeline.analyze_text(text)
+    backend = fresh_pipeline(llm.FakeBackend())
+    result = pipeline.analyze_text(text)
+    assert result["cached"] is enabled
+    assert (backend.calls == 0) is enabled
+
+def test_least_recently_used_entries_are_evicted_over_the_size_limit(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "small.sqlite3"), max_bytes=350)
+    for key in ("a", "b", "c"):
+        cache.put(key, "x" * 100)
+        time.sleep(0.01)
+    # Reading "a" makes "b" the least recently used entry
+    assert cache.get("a") is not None
+    time.sleep(0.01)
+    cache.put("d", "x" * 100)
+    assert [k for k in "abcd" if cache.get(k, counter=None) is not None] == ["a", "c", "d"]
+
+def test_entries_expire_after_max_age(tmp_path, monkeypatch):
+    cache = AnalysisCache(str(tmp_path / "aged.sqlite3"), max_age_seconds=60)
+    cache.put("key", {"value": 1})
+    assert cache.get("key") == {"value": 1}
+    monkeypatch.setattr(time, "time", lambda now=time.time(): now + 61)
+    assert cache.get("key") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 0, "bytes": 0}
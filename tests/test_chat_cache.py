@@ -0,0 +1,97 @@
+import pytest
+import llm, pipeline
+from conftest import make_text
+
+@pytest.fixture
+def chat_cache(fresh_pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "CHAT_CACHE_MIN_TOKENS", 1000)
+    monkeypatch.setattr(pipeline, "_chat_caches", {})
+    return fresh_pipeline(llm.FakeBackend(seconds_per_1k_tokens=0.01))
+
+SUMMARY = {"summary": [{"text": "Accounts can be closed without notice."}]}
+
+def answer(prompt, cache_name):
+    return list(pipeline.stream_gemini_prompt(prompt, cached_content=cache_name))
+
+def test_long_documents_are_cached_once_with_their_summary(chat_cache):
+    text = make_text(20000)
+    name = pipeline.get_chat_cache(text, SUMMARY)
+    assert name and pipeline.get_chat_cache(text, SUMMARY) == name
+    assert list(chat_cache.caches) == [name]
+    contents, _ = chat_cache.caches[name]
+    assert "Accounts can be closed without notice." in contents and text[:200] in contents
+
+def test_short_documents_are_not_cached(chat_cache):
+    assert pipeline.get_chat_cache(make_text(1000)) is None
+    assert chat_cache.caches == {}
+
+def test_questions_against_the_cache_skip_resending_the_document(chat_cache):
+    text = make_text(200000)
+    name = pipeline.get_chat_cache(text, SUMMARY)
+    answer("USER QUESTION: Can they close my account?", name)
+    answer(f"CONTEXT:\n{text}\n\nUSER QUESTION: Can they close my account?", None)
+    # Per-token cost of the cached context is not paid again per question
+    cached_latency, uncached_latency = chat_cache.call_latencies
+    assert cached_latency < uncached_latency / 100
+
+def test_failed_cache_creation_falls_back_and_is_not_retried_per_question(chat_cache, monkeypatch):
+    calls = []
+
+    def refuse(*args):
+        calls.append(args)
+        raise RuntimeError("Context caching is not available on the free tier")
+    monkeypatch.setattr(chat_cache, "create_cache", refuse)
+    text = make_text(20000)
+    assert pipeline.get_chat_cache(text) is None
+    assert pipeline.get_chat_cache(text) is None
+    assert len(calls) == 1
+
+def test_an_expired_cache_is_replaced_after_it_fails(chat_cache):
+    text = make_text(20000)
+    name = pipeline.get_chat_cache(text)
+    chat_cache.caches[name] = (chat_cache.caches[name][0], 0)
+    assert pipeline.chat_cache_missing(answer("USER QUESTION: hi", name)[-1])
+    pipeline.forget_chat_cache(name)
+    replacement = pipeline.get_chat_cache(text)
+    assert replacement and replacement != name
+
+def test_forgetting_a_cache_deletes_it_on_the_server(chat_cache):
+    name = pipeline.get_chat_cache(make_text(20000))
+    pipeline.forget_chat_cache(name)
+    assert chat_cache.caches == {}
+
+@pytest.mark.parametrize("result,missing", [
+    ({"error": "404 Fake backend: cached content cachedContents/x not found"}, True),
+    ({"error": "API_QUOTA_EXCEEDED", "message": "API rate limit exceeded. Please wait a minute and try again."}, False),
+    ({"error": "503 The service is currently unavailable"}, False),
+    ("a text piece", False),
+])
+def test_only_missing_cache_errors_count_as_missing(result, missing):
+    assert pipeline.chat_cache_missing(result) is missing
+
+def test_caches_are_created_for_a_versioned_model_without_holding_the_lock(chat_cache, monkeypatch):
+    created = []
+    create = chat_cache.create_cache
+
+    def create_unlocked(model_name, *args):
+        assert not pipeline._chat_cache_lock.locked()
+        created.append(model_name)
+        return create(model_name, *args)
+    monkeypatch.setattr(chat_cache, "create_cache", create_unlocked)
+    assert pipeline.get_chat_cache(make_text(20000))
+    assert created == [pipeline.CHAT_CACHE_MODEL] and pipeline.CHAT_CACHE_MODEL.endswith("-001")
+
+def test_a_cache_created_concurrently_is_kept_and_the_duplicate_deleted(chat_cache, monkeypatch):
+    text = make_text(20000)
+    create = chat_cache.create_cache
+
+    def create_racing(*args):
+        # Another session finishes creating its cache while this one is in flight
+        monkeypatch.setattr(chat_cache, "create_cache", create)
+        first = pipeline.get_chat_cache(text)
+        racing.append(first)
+        return create(*args)
+    racing = []
+    monkeypatch.setattr(chat_cache, "create_cache", create_racing)
+    assert pipeline.get_chat_cache(text) == racing[0]
+    assert list(chat_cache.caches) == racing
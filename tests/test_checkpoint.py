@@ -0,0 +1,41 @@
+import pytest
+import llm, pipeline
+from conftest import make_text
+
+class InterruptedBackend(llm.FakeBackend):
+    """Answers chunk_calls chunk requests, then stops the run like Ctrl+C or a killed worker would."""
+
+    def __init__(self, chunk_calls, **kwargs):
+        super().__init__(**kwargs)
+        self.chunk_calls = chunk_calls
+
+    def generate(self, prompt, model_name, **kwargs):
+        if "Text chunk" in prompt:
+            with self._lock:
+                self.chunk_calls -= 1
+                if self.chunk_calls < 0:
+                    raise KeyboardInterrupt
+        return super().generate(prompt, model_name, **kwargs)
+
+def test_chunks_finished_before_an_interrupt_are_not_repeated(fresh_pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "CHUNK_BATCH_SIZE", 1)
+    text = make_text(300000, seed=8)
+    fresh_pipeline(InterruptedBackend(chunk_calls=5))
+    plans = []
+    with pytest.raises(KeyboardInterrupt):
+        pipeline.analyze_text(text, max_workers=1, use_cache=False, on_plan=plans.append)
+
+    backend = fresh_pipeline(llm.FakeBackend())
+    resumed = []
+    result = pipeline.analyze_text(text, use_cache=False, on_plan=resumed.append)
+    assert "error" not in result
+    assert resumed[0]["planned_calls"] == plans[0]["planned_calls"] - 5
+
+def test_merges_finished_before_an_interrupt_are_not_repeated(fresh_pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "CONSOLIDATION_FAN_IN", 2)
+    memo, saved = {}, []
+    summaries = [{"bullets": [{"text": f"Point {n}"}]} for n in range(8)]
+    fresh_pipeline(llm.FakeBackend())
+    pipeline.consolidate_summaries(summaries, max_workers=1, memo=memo, on_merged=lambda: saved.append(len(memo)))
+    # One save per finished merge (4 + 2 groups before the final summary), each with that merge in memo
+    assert len(saved) == 6 and saved[-1] == len(memo)
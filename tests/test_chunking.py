@@ -0,0 +1,36 @@
+import pytest
+from conftest import make_text
+from utils import chunk_spans_content_defined, chunk_spans_sentence_aware, chunk_text_content_defined
+
+CHUNKERS = [chunk_spans_sentence_aware, chunk_spans_content_defined]
+
+@pytest.mark.parametrize("chunker", CHUNKERS)
+@pytest.mark.parametrize("max_chars,overlap", [(500, 0), (500, 100), (3000, 200)])
+def test_chunks_fit_and_cover_the_text_in_order(chunker, max_chars, overlap):
+    text = make_text(20000, seed=6)
+    spans = chunker(text, max_chars=max_chars, overlap_chars=overlap)
+    assert all(0 < end - start <= max_chars for start, end in spans)
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    for (start, end), (next_start, next_end) in zip(spans, spans[1:]):
+        assert start < next_start and end < next_end
+        # Consecutive chunks overlap by at most overlap characters, or are separated by whitespace only
+        assert end - overlap <= next_start
+        assert not text[end:next_start].strip()
+
+@pytest.mark.parametrize("chunker", CHUNKERS)
+def test_sentences_longer_than_a_chunk_are_split(chunker):
+    text = "word " * 2000
+    spans = chunker(text, max_chars=300, overlap_chars=50)
+    assert all(end - start <= 300 for start, end in spans)
+    assert spans[-1][1] == len(text)
+
+@pytest.mark.parametrize("chunker", CHUNKERS)
+def test_empty_text_has_no_chunks(chunker):
+    assert chunker("", max_chars=500) == []
+
+def test_content_defined_chunks_survive_an_inserted_paragraph():
+    text = make_text(40000, seed=7)
+    before = chunk_text_content_defined(text, max_chars=2000, overlap_chars=0)
+    after = chunk_text_content_defined("A brand new opening paragraph about refunds. " * 5 + text, max_chars=2000, overlap_chars=0)
+    unchanged = set(before) & set(after)
+    assert len(unchanged) >= len(before) - 2
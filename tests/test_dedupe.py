@@ -0,0 +1,15 @@
+from conftest import make_text
+from dedupe import find_near_duplicates
+
+def test_repeated_and_lightly_edited_sections_map_to_the_first_copy():
+    section = make_text(3000, seed=8)
+    edited = section.replace("account", "accounts", 1)
+    chunks = [section, make_text(3000, seed=9), edited, make_text(3000, seed=10), section]
+    assert find_near_duplicates(chunks, threshold=0.85) == {2: 0, 4: 0}
+
+def test_distinct_sections_are_not_duplicates():
+    chunks = [make_text(3000, seed=seed) for seed in range(20)]
+    assert find_near_duplicates(chunks, threshold=0.85) == {}
+
+def test_empty_chunks_do_not_match_real_ones():
+    assert find_near_duplicates(["", make_text(1000)]) == {}
@@ -0,0 +1,45 @@
+import time
+import utils
+from utils import OCR_LIKELY_SCAN, OCR_NEEDED, OCR_SKIP, PAGE_BREAK, extract_text_from_pdf
+
+TEXT_PAGE = "BT /F1 10 Tf 50 780 Td (" + "Fees are billed monthly. " * 10 + ") Tj ET"
+# A scan drawn as vector paths: no selectable text and no image objects
+VECTOR_PAGE = "50 50 m 300 400 l S 60 60 200 100 re f"
+BLANK_PAGE = ""
+
+def make_pdf(path, streams):
+    """Minimal PDF with one page per content stream."""
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>",
+            f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(len(streams)))}] /Count {len(streams)} >>",
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for i, stream in enumerate(streams):
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    out, offsets = "%PDF-1.4\n", []
+    for n, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f"{n} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n" + "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    path.write_text(out)
+    return str(path)
+
+def test_pages_without_text_need_ocr_even_without_images(tmp_path):
+    path = make_pdf(tmp_path / "doc.pdf", [TEXT_PAGE, VECTOR_PAGE, BLANK_PAGE])
+    priorities = [priority for _, priority in utils._extract_page_range(path, 1, 3)]
+    assert priorities == [OCR_SKIP, OCR_NEEDED, OCR_SKIP]
+    assert OCR_LIKELY_SCAN > OCR_NEEDED
+
+def test_image_free_scanned_pages_are_ocrd(tmp_path, monkeypatch):
+    path = make_pdf(tmp_path / "doc.pdf", [TEXT_PAGE, VECTOR_PAGE, BLANK_PAGE])
+    windows = []
+
+    def fake_ocr(path, first_page, last_page):
+        windows.append((first_page, last_page))
+        pages = [(f"OCR text of page {n}", time.time(), 0.0) for n in range(first_page, last_page + 1)]
+        return (time.time(), 0.0), pages
+    monkeypatch.setattr(utils, "_ocr_page_window", fake_ocr)
+    text = extract_text_from_pdf(path, max_workers=1)
+    assert windows == [(2, 2)]
+    assert text.split(PAGE_BREAK)[1].strip() == "OCR text of page 2"
@@ -0,0 +1,29 @@
+import pytest
+import llm, pipeline
+from conftest import make_text
+
+@pytest.mark.parametrize("seed", range(5))
+def test_results_in_flight_when_the_quota_runs_out_are_kept(fresh_pipeline, seed):
+    backend = fresh_pipeline(llm.FakeBackend(latency=0.01, latency_sigma=0.8, daily_quota_after=10, seed=seed))
+    delivered = {}
+    results, quota_exceeded = pipeline.run_prompts_concurrently([f"Question {n}" for n in range(30)], max_workers=4,
+                                                                on_result=delivered.__setitem__)
+    assert quota_exceeded
+    assert len(delivered) == 10
+    assert sum(r is not None for r in results) == 10
+
+def test_resumed_analysis_only_pays_for_unfinished_chunks(fresh_pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "CHUNK_BATCH_SIZE", 1)
+    text = make_text(300000, seed=4)
+    fresh_pipeline(llm.FakeBackend(latency=0.01, latency_sigma=0.8, daily_quota_after=6))
+    plans = []
+    first = pipeline.analyze_text(text, use_cache=False, on_plan=plans.append)
+    assert first["error"] == "API_QUOTA_EXCEEDED" and first["resumable"]
+    assert len(first["chunks"]) == 6
+
+    backend = fresh_pipeline(llm.FakeBackend())
+    resumed = []
+    second = pipeline.analyze_text(text, use_cache=False, on_plan=resumed.append)
+    assert "error" not in second
+    assert resumed[0]["planned_calls"] == plans[0]["planned_calls"] - 6
+    assert backend.calls >= resumed[0]["planned_calls"]
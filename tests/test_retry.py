@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+import pytest
+from google.api_core import exceptions as api_exceptions
+import retry
+from retry import (CircuitBreaker, CircuitOpenError, RequestNotSent, call_with_retry, classify_error,
+                   DAILY_QUOTA, FATAL, RATE_LIMITED, TRANSIENT)
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(retry, "random", SimpleNamespace(uniform=lambda a, b: 0.0))
+    monkeypatch.setattr(retry, "time", SimpleNamespace(monotonic=retry.time.monotonic, sleep=sleeps.append))
+    return sleeps
+
+@pytest.mark.parametrize("error,expected", [
+    (api_exceptions.ResourceExhausted("Quota exceeded for metric GenerateRequestsPerDayPerProjectPerModel-FreeTier"), (DAILY_QUOTA, None)),
+    (api_exceptions.TooManyRequests("429 Resource has been exhausted. Please retry in 27.3s"), (RATE_LIMITED, 27.3)),
+    (api_exceptions.ServiceUnavailable("503 The service is currently unavailable"), (TRANSIENT, None)),
+    (api_exceptions.DeadlineExceeded("Deadline exceeded"), (TRANSIENT, None)),
+    (ConnectionError("connection reset"), (TRANSIENT, None)),
+    (api_exceptions.PermissionDenied("403 API key not valid"), (FATAL, None)),
+    (ValueError("response blocked by safety filters"), (FATAL, None)),
+])
+def test_classify_error(error, expected):
+    assert classify_error(error) == expected
+
+@pytest.mark.parametrize("message,expected", [
+    ("429 Resource has been exhausted. Please retry in 27.3s.", 27.3),
+    ("429 Please retry in 519.765622ms.", 0.519765622),
+    ("429 Quota exceeded\nretry_delay {\n  seconds: 27\n}", 27.0),
+    ("503 The service is unavailable, please retry.", None),
+    ("429 Rate limit reached, the client will retry 3 times", None),
+])
+def test_retry_after_seconds(message, expected):
+    assert retry.retry_after_seconds(message) == (pytest.approx(expected) if expected is not None else None)
+
+def test_a_bare_retry_hint_is_still_retried(no_backoff):
+    fn = flaky(api_exceptions.ServiceUnavailable("503 Service unavailable, please retry."), "ok")
+    assert call_with_retry(fn) == "ok"
+    assert fn.calls == 2
+
+def flaky(*outcomes):
+    """fn(timeout) that raises or returns each outcome in turn; its calls are counted in fn.calls."""
+    outcomes = list(outcomes)
+
+    def fn(timeout):
+        fn.calls += 1
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    fn.calls = 0
+    return fn
+
+def test_transient_errors_are_retried_with_the_server_hint(no_backoff):
+    fn = flaky(api_exceptions.TooManyRequests("429 Please retry in 2s"), api_exceptions.ServiceUnavailable("503"), "ok")
+    assert call_with_retry(fn, max_attempts=4) == "ok"
+    assert fn.calls == 3
+    assert no_backoff == [2.0, 0.0]
+
+@pytest.mark.parametrize("error", [api_exceptions.PermissionDenied("403"),
+                                   api_exceptions.ResourceExhausted("Quota exceeded: GenerateRequestsPerDay")])
+def test_fatal_and_daily_quota_errors_are_not_retried(error):
+    fn = flaky(error, "ok")
+    with pytest.raises(type(error)):
+        call_with_retry(fn)
+    assert fn.calls == 1
+
+def test_retries_stop_after_max_attempts():
+    fn = flaky(*[api_exceptions.ServiceUnavailable("503")] * 5)
+    with pytest.raises(api_exceptions.ServiceUnavailable):
+        call_with_retry(fn, max_attempts=3)
+    assert fn.calls == 3
+
+def test_open_circuit_fails_fast_without_calling():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    failing = flaky(*[api_exceptions.ServiceUnavailable("503")] * 2)
+    with pytest.raises(api_exceptions.ServiceUnavailable):
+        call_with_retry(failing, breaker=breaker, max_attempts=2)
+    fn = flaky("ok")
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(fn, breaker=breaker)
+    assert fn.calls == 0
+
+def test_request_not_sent_frees_the_half_open_trial(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    with pytest.raises(RequestNotSent):
+        call_with_retry(flaky(RequestNotSent("no budget")), breaker=breaker)
+    # Another caller may still try the half-open circuit, which stays open until a call succeeds
+    assert call_with_retry(flaky("ok"), breaker=breaker) == "ok"
@@ -0,0 +1,30 @@
+from pipeline import merge_chunk_risks
+
+def risk(type_, severity, excerpt, note="Matters to users."):
+    return {"type": type_, "severity": severity, "excerpt": excerpt, "note": note}
+
+def test_near_duplicates_of_one_type_keep_the_most_severe_copy():
+    summaries = [
+        {"risks": [risk("Arbitration", "Medium", "disputes are settled by binding arbitration")]},
+        {"risks": [risk("arbitration", "High", "all disputes are settled by binding arbitration")]},
+    ]
+    merged = merge_chunk_risks(summaries)
+    assert merged == [summaries[1]["risks"][0]]
+
+def test_ranked_by_severity_then_by_how_often_the_type_came_up():
+    summaries = [
+        {"risks": [risk("Fees", "low", "a fee applies"), risk("Data Sharing", "Medium", "we share data with partners")]},
+        {"risks": [risk("Renewal", "Medium", "plans renew automatically")]},
+        {"risks": [risk("Renewal", "Medium", "cancel before the renewal date to avoid charges")]},
+        {"risks": [risk("Termination", "HIGH", "we may close accounts at any time")]},
+    ]
+    merged = merge_chunk_risks(summaries)
+    assert [r["type"] for r in merged] == ["Termination", "Renewal", "Renewal", "Data Sharing", "Fees"]
+    assert merged[-1]["severity"] == "Low"
+
+def test_malformed_entries_are_ignored_and_the_list_is_capped():
+    summaries = [{"raw": "not json"}, {"error": "503"}, None,
+                 {"risks": [{"severity": "High"}, "text"] + [risk(f"Type {n}", "Low", f"clause {n}") for n in range(15)]}]
+    merged = merge_chunk_risks(summaries, max_risks=10)
+    assert len(merged) == 10
+    assert all(r["type"].startswith("Type") for r in merged)
@@ -0,0 +1,14 @@
+from utils import PAGE_BREAK, sanitize_text
+
+def test_words_split_across_lines_are_rejoined_when_the_document_uses_them():
+    text = "This agree-\nment is binding. Read the agreement carefully."
+    assert sanitize_text(text) == "This agreement is binding. Read the agreement carefully."
+
+def test_compounds_broken_at_a_line_end_keep_their_hyphen():
+    text = "We share data with third-\nparty vendors under a non-\nexclusive license."
+    assert sanitize_text(text) == "We share data with third-party vendors under a non-exclusive license."
+
+def test_running_headers_and_page_numbers_are_removed():
+    bodies = ["Fees are billed monthly.", "Refunds take ten days.", "Disputes go to arbitration.", "Accounts may be closed."]
+    pages = [f"ACME Terms of Service\n{body}\nPage {i} of 4" for i, body in enumerate(bodies, 1)]
+    assert sanitize_text(PAGE_BREAK.join(pages)) == "\n\n".join(bodies)
@@ -0,0 +1,34 @@
+import pytest
+from schemas import CHUNK_BATCH_SCHEMA, CHUNK_SCHEMA, RISKS_SCHEMA, SUMMARY_SCHEMA, SchemaError, validate
+
+def test_unknown_keys_are_dropped_and_strings_stripped():
+    value = {"summary": [{"text": "  Point  ", "excerpt": "quote", "extra": 1}], "other": True}
+    assert validate(value, SUMMARY_SCHEMA) == {"summary": [{"text": "Point", "excerpt": "quote"}]}
+
+def test_severity_is_matched_case_insensitively():
+    risks = validate([{"type": "Fees", "severity": "HIGH"}, {"type": "Data", "severity": "medium"}], RISKS_SCHEMA)
+    assert [r["severity"] for r in risks] == ["High", "Medium"]
+
+def test_array_items_that_do_not_fit_are_skipped():
+    value = {"bullets": [{"text": "ok"}, {"excerpt": "no text"}, "loose string"],
+             "risks": [{"type": "Fees", "severity": "extreme"}, {"type": "Fees", "severity": "Low"}]}
+    assert validate(value, CHUNK_SCHEMA) == {"bullets": [{"text": "ok"}], "risks": [{"type": "Fees", "severity": "Low"}]}
+
+@pytest.mark.parametrize("value", [[], {"bullets": []}, {"bullets": {}, "risks": []}, "text"])
+def test_values_that_do_not_fit_raise(value):
+    with pytest.raises(SchemaError):
+        validate(value, CHUNK_SCHEMA)
+
+def test_null_counts_as_missing():
+    with pytest.raises(SchemaError, match="missing risks"):
+        validate({"bullets": [], "risks": None}, CHUNK_SCHEMA)
+
+@pytest.mark.parametrize("chunk_id,expected", [(3, 3), ("4", 4), (5.0, 5)])
+def test_batch_ids_accept_whole_numbers(chunk_id, expected):
+    value = validate({"chunks": [{"id": chunk_id, "bullets": [], "risks": []}]}, CHUNK_BATCH_SCHEMA)
+    assert value["chunks"][0]["id"] == expected
+
+@pytest.mark.parametrize("chunk_id", [True, 2.5, "two", None])
+def test_batch_entries_without_a_usable_id_are_skipped(chunk_id):
+    value = validate({"chunks": [{"id": chunk_id, "bullets": [], "risks": []}]}, CHUNK_BATCH_SCHEMA)
+    assert value == {"chunks": []}
@@ -0,0 +1,51 @@
+import json, time
+import pytest
+import llm, pipeline, tracing
+
+def test_traces_are_not_written_unless_a_path_is_set(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_PATH", "")
+    monkeypatch.chdir(tmp_path)
+    with tracing.start_trace("analysis"):
+        pass
+    assert list(tmp_path.iterdir()) == []
+
+def test_trace_file_is_rotated_at_its_size_limit(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_PATH", str(path))
+    monkeypatch.setattr(tracing, "TRACE_MAX_MB", 0.002)
+    for n in range(20):
+        with tracing.start_trace("analysis", n=n):
+            with tracing.span("stage"):
+                pass
+    kept = [json.loads(line)["n"] for name in ("traces.jsonl.1", "traces.jsonl") for line in (tmp_path / name).read_text().splitlines()]
+    assert sorted(tmp_path.iterdir()) == [path, tmp_path / "traces.jsonl.1"]
+    assert path.stat().st_size <= 0.002 * 1024 * 1024
+    assert kept == list(range(20 - len(kept), 20))
+
+def test_spans_timed_in_workers_keep_their_own_start(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_PATH", "")
+    with tracing.start_trace("analysis") as trace:
+        started = time.time()
+        time.sleep(0.05)
+        # Two pages OCR'd side by side in different processes, reported after both finished
+        tracing.record("ocr_page", 0.02, wall_start=started, page=1)
+        tracing.record("ocr_page", 0.02, wall_start=started, page=2)
+    first, second = trace.to_dict()["spans"]
+    assert first["start_ms"] == pytest.approx(second["start_ms"], abs=1)
+    assert first["start_ms"] < 10
+
+class ReportingBackend(llm.FakeBackend):
+    def generate(self, prompt, model_name, usage=None, **kwargs):
+        text = super().generate(prompt, model_name, **kwargs)
+        usage.update(prompt_tokens=123, response_tokens=45)
+        return text
+
+@pytest.mark.parametrize("backend,estimated", [(llm.FakeBackend(), True), (ReportingBackend(), False)])
+def test_llm_spans_use_reported_token_counts_and_flag_estimates(fresh_pipeline, backend, estimated):
+    fresh_pipeline(backend)
+    prompt = "Answer in JSON: " + "word " * 400
+    with tracing.start_trace("analysis") as trace:
+        pipeline.run_gemini_prompt(prompt)
+    span, = [s for s in trace.to_dict()["spans"] if s["name"] == "llm_call"]
+    assert span["tokens_estimated"] is estimated
+    assert span["prompt_tokens"] == (pipeline.estimate_tokens(prompt) if estimated else 123)